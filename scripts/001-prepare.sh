@@ -77,15 +77,13 @@ for patch in $(find patches/kolla-build/$OPENSTACK_VERSION -type f -name '*.patc
     popd > /dev/null
 done
 
-# Prepare repos.yaml
+# Prepare repos.yaml and apt_preferences.ubuntu
 
+GENERATE_ARGS=(--apt-preferences overlays/$OPENSTACK_VERSION/base/apt_preferences.ubuntu)
 if [[ -f templates/$OPENSTACK_VERSION/repos.yaml ]]; then
-    python3 src/merge-repos-yaml.py templates/$OPENSTACK_VERSION/repos.yaml $PROJECT_REPOSITORY_PATH/kolla/template/repos.yaml
+    GENERATE_ARGS+=(--merge-repos templates/$OPENSTACK_VERSION/repos.yaml $PROJECT_REPOSITORY_PATH/kolla/template/repos.yaml)
 fi
-
-# Prepare apt_preferences.ubuntu
-
-python3 src/generate-apt-preferences-files.py > overlays/$OPENSTACK_VERSION/base/apt_preferences.ubuntu
+python3 src/generate-all.py "${GENERATE_ARGS[@]}"
 
 echo DEBUG apt_preferences.ubuntu
 cat overlays/$OPENSTACK_VERSION/base/apt_preferences.ubuntu
@@ -120,7 +118,7 @@ export KOLLA_VERSION=$(kolla-build --version)
 
 export HASH_DOCKER_IMAGES_KOLLA=$(git rev-parse --short HEAD)
 export HASH_RELEASE=$(cd $RELEASE_REPOSITORY_PATH; git rev-parse --short HEAD)
-python3 src/generate-template-overrides-file.py > templates/$OPENSTACK_VERSION/template-overrides.j2
+python3 src/generate-all.py --template-overrides templates/$OPENSTACK_VERSION/template-overrides.j2
 
 echo DEBUG template-overrides.j2
 cat templates/$OPENSTACK_VERSION/template-overrides.j2
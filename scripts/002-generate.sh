@@ -40,19 +40,6 @@ KOLLA_INSTALL_TYPE=source
 
 # Generate configuration
 
-python3 src/generate-kolla-build-config.py > $KOLLA_CONF_FILE
-
-# Prepare configuration
-
-setini () {
-    ansible localhost -i localhost, -c local -e ansible_python_interpreter=/usr/bin/python3 -m ini_file -a "path=kolla-build.conf section=$1 option=$2 value=$3"
-}
-
-setini DEFAULT namespace $DOCKER_NAMESPACE
-setini DEFAULT tag $DOCKER_TAG
-setini DEFAULT base $KOLLA_BASE
-setini DEFAULT base_tag $KOLLA_BASE_TAG
-setini DEFAULT install_type $KOLLA_INSTALL_TYPE
 # NOTE: Upstream renames stable/<version> to unmaintained/<version> when a
 # release enters the unmaintained phase. tarballs.opendev.org keeps serving the
 # requirements-stable-<version> artifact but stops refreshing it, so the branch
@@ -63,14 +50,24 @@ else
     REQUIREMENTS_BRANCH="stable-$OPENSTACK_VERSION"
 fi
 
-setini openstack-base location tarballs/requirements-$REQUIREMENTS_BRANCH.tar.gz
-sed -i "/\[openstack-base\]/a # tarball = https://tarballs.opendev.org/openstack/requirements/requirements-$REQUIREMENTS_BRANCH.tar.gz" $KOLLA_CONF_FILE
-setini openstack-base type local
-
+# NOTE: The options are set in the same way as with the ini_file module of
+# Ansible, in this order.
+SETTINGS=(
+    --set DEFAULT namespace $DOCKER_NAMESPACE
+    --set DEFAULT tag $DOCKER_TAG
+    --set DEFAULT base $KOLLA_BASE
+    --set DEFAULT base_tag $KOLLA_BASE_TAG
+    --set DEFAULT install_type $KOLLA_INSTALL_TYPE
+    --set openstack-base location tarballs/requirements-$REQUIREMENTS_BRANCH.tar.gz
+    --set openstack-base type local
+)
 
 if [[ -n $DOCKER_REGISTRY ]]; then
-    setini DEFAULT registry $DOCKER_REGISTRY
+    SETTINGS+=(--set DEFAULT registry $DOCKER_REGISTRY)
 fi
 
+python3 src/generate-all.py --kolla-build-config $KOLLA_CONF_FILE "${SETTINGS[@]}"
+sed -i "/\[openstack-base\]/a # tarball = https://tarballs.opendev.org/openstack/requirements/requirements-$REQUIREMENTS_BRANCH.tar.gz" $KOLLA_CONF_FILE
+
 echo DEBUG kolla-build.conf
 cat kolla-build.conf
@@ -31,57 +31,21 @@ fi
 . defaults/all.sh
 . defaults/$OPENSTACK_VERSION.sh
 
+export DOCKER_NAMESPACE
+export DOCKER_REGISTRY
 export IS_RELEASE
 export OPENSTACK_VERSION
+export SOURCE_DOCKER_TAG
 export VERSION
 
 rm -f $LSTFILE
-touch $LSTFILE
 
 docker image prune --filter="dangling=true" -f
 docker images
 
-# change build_id tags to openstack version tags
-docker images -f label="de.osism.release.openstack=${OPENSTACK_VERSION}" | tail -n +2 | awk '{ print $1 }' | while read image; do
-    imagename=$(echo $image | awk -F/ '{ print $NF }')
-
-    if [[ $imagename != "<none>" ]]; then
-        new_imagename=${imagename#${KOLLA_TYPE}}
-
-        # http://stackoverflow.com/questions/12766406/how-to-get-the-first-part-of-the-string-in-bash
-        project=${new_imagename%%-*}
-
-        # For releases, add /release/$OPENSTACK_VERSION to the namespace
-        if [[ $IS_RELEASE == "True" ]]; then
-            new_imagename="$DOCKER_NAMESPACE/release/$OPENSTACK_VERSION/$new_imagename"
-        else
-            new_imagename="$DOCKER_NAMESPACE/$new_imagename"
-        fi
-        if [[ ! -z $DOCKER_REGISTRY ]]; then
-            new_imagename="$DOCKER_REGISTRY/$new_imagename"
-        fi
-
-        if [[ "$OPENSTACK_VERSION" == "latest" ]]; then
-            tag=latest
-            docker tag $image:$SOURCE_DOCKER_TAG $new_imagename:$tag
-            echo "$new_imagename:$tag" >> $LSTFILE
-        else
-            if [[ $VERSION == "latest" ]]; then
-                tag=$OPENSTACK_VERSION
-            else
-                tag=$VERSION
-            fi
-            docker tag $image:$SOURCE_DOCKER_TAG $new_imagename:$tag
-            echo "$new_imagename:$tag" >> $LSTFILE
-        fi
-
-        # remove the build_id tag
-        docker rmi $image:$SOURCE_DOCKER_TAG
-    fi
-done
-docker images
-
-python3 src/tag-images-with-the-version.py
+# change build_id tags to openstack version tags and tag the images with the
+# versions of the contained services
+python3 src/tag-images-with-the-version.py --retag
 docker images
 
 if [[ $IS_RELEASE == "True" ]]; then
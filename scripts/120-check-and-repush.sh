@@ -11,12 +11,16 @@ set -e
 # DRY_RUN          - Set to 'true' to only check without pushing (default: false)
 # VERBOSE          - Set to 'true' for verbose output (default: false)
 # CHECK_DIGESTS    - Set to 'true' to compare layer digests (default: false)
+# DIGEST_MODE      - How digests are compared: config, repo-digests or pull (default: config)
+# REPORT_FILE      - Path of the JSON report of the registry check (default: registry-check.json)
 
 # Set default values
 IMAGES_FILE=${IMAGES_FILE:-images.lst}
 DRY_RUN=${DRY_RUN:-false}
 VERBOSE=${VERBOSE:-false}
 CHECK_DIGESTS=${CHECK_DIGESTS:-false}
+DIGEST_MODE=${DIGEST_MODE:-config}
+REPORT_FILE=${REPORT_FILE:-registry-check.json}
 
 # Colors for output
 RED='\033[0;31m'
@@ -48,22 +52,6 @@ log_verbose() {
     fi
 }
 
-# Function to check if an image exists on the registry
-check_image_exists() {
-    local image="$1"
-    log_verbose "Checking if image exists: $image"
-
-    # Use docker manifest inspect to check if image exists
-    # This is more reliable than docker pull for just checking existence
-    if docker manifest inspect "$image" >/dev/null 2>&1; then
-        log_verbose "Image exists: $image"
-        return 0
-    else
-        log_verbose "Image does not exist: $image"
-        return 1
-    fi
-}
-
 # Function to check if image exists locally
 check_local_image_exists() {
     local image="$1"
@@ -78,38 +66,6 @@ check_local_image_exists() {
     fi
 }
 
-# Function to get manifest digest for comparison
-get_manifest_digest() {
-    local image="$1"
-
-    # Get the manifest digest using docker manifest inspect
-    # Note: this may not return .digest for all registry types
-    local manifest_json
-    manifest_json=$(docker manifest inspect "$image" 2>/dev/null)
-
-    if [[ -n "$manifest_json" ]]; then
-        # Try to get digest from manifest
-        local digest
-        digest=$(echo "$manifest_json" | jq -r '.digest // empty' 2>/dev/null)
-
-        if [[ "$digest" != "empty" && "$digest" != "null" && -n "$digest" ]]; then
-            echo "$digest"
-        else
-            # Calculate digest from manifest content itself
-            echo "$manifest_json" | sha256sum | cut -d' ' -f1 | sed 's/^/sha256:/'
-        fi
-    fi
-}
-
-# Function to get repo digest from local image
-get_local_repo_digest() {
-    local image="$1"
-
-    # Try to get the repo digest from the local image
-    # This should match the manifest digest if the image was pulled from the same registry
-    docker image inspect "$image" 2>/dev/null | jq -r '.[0].RepoDigests[]?' 2>/dev/null | grep -E "^${image%:*}@" | head -1 | cut -d'@' -f2
-}
-
 # Function to get detailed layer information for verbose output
 get_layer_details() {
     local image="$1"
@@ -246,6 +202,9 @@ main() {
     log_info "Dry run mode: $DRY_RUN"
     log_info "Verbose mode: $VERBOSE"
     log_info "Check digests mode: $CHECK_DIGESTS"
+    if [[ "$CHECK_DIGESTS" == "true" ]]; then
+        log_info "Digest mode: $DIGEST_MODE"
+    fi
 
     # Check if images file exists
     if [[ ! -f "$IMAGES_FILE" ]]; then
@@ -268,6 +227,29 @@ main() {
     total_images=$(wc -l < "$IMAGES_FILE")
     log_info "Total images to check: $total_images"
 
+    # Check all images on the registry at once, every manifest is fetched once
+    checker_args=(--images-file "$IMAGES_FILE" --output "$REPORT_FILE")
+    # NOTE: In the pull mode, the images are compared by compare_layer_digests
+    if [[ "$CHECK_DIGESTS" == "true" && "$DIGEST_MODE" != "pull" ]]; then
+        checker_args+=(--check-digests --digest-mode "$DIGEST_MODE")
+    fi
+    checker_rc=0
+    python3 src/check-registry-images.py "${checker_args[@]}" || checker_rc=$?
+    if [[ $checker_rc -eq 2 ]]; then
+        log_error "Registry check failed, see above"
+        exit 1
+    fi
+    log_info "Registry check report: $REPORT_FILE"
+
+    declare -A image_status
+    declare -A image_digest
+    declare -A image_digest_match
+    while read -r status digest digest_match checked_image; do
+        image_status["$checked_image"]=$status
+        image_digest["$checked_image"]=$digest
+        image_digest_match["$checked_image"]=$digest_match
+    done < <(jq -r '.images[] | "\(.status) \(.digest) \(.digest_match) \(.image)"' "$REPORT_FILE")
+
     # Read and process each image
     current=0
     while IFS= read -r image || [[ -n "$image" ]]; do
@@ -280,13 +262,32 @@ main() {
         current=$((current + 1))
         log_info "[$current/$total_images] Checking: $image"
 
-        if check_image_exists "$image"; then
+        status=${image_status["$image"]:-missing}
+
+        # NOTE: If the registry check failed after the manifest was fetched,
+        #       the image exists and only its digests could not be compared,
+        #       they are compared after a pull. Images whose manifest could
+        #       not be fetched are handled as missing.
+        if [[ "$status" == "error" ]]; then
+            if [[ "${image_digest["$image"]}" != "null" ]]; then
+                log_warning "[$current/$total_images] Registry digest check failed, comparing after a pull: $image"
+                status=exists
+                image_digest_match["$image"]=null
+            else
+                log_warning "[$current/$total_images] Registry check failed, handling as missing: $image"
+                status=missing
+            fi
+        fi
+
+        if [[ "$status" == "exists" || "$status" == "mismatch" ]]; then
             log_success "[$current/$total_images] EXISTS: $image"
 
             # If digest checking is enabled, compare layer digests
             if [[ "$CHECK_DIGESTS" == "true" ]]; then
                 if check_local_image_exists "$image"; then
-                    if compare_layer_digests "$image"; then
+                    # NOTE: The image IDs are only compared after a pull if the
+                    #       registry check could not compare the digests.
+                    if [[ "$status" == "exists" ]] && { [[ "${image_digest_match["$image"]}" == "true" ]] || compare_layer_digests "$image"; }; then
                         existing_images+=("$image")
                         log_success "[$current/$total_images] DIGESTS MATCH: $image"
                     else
@@ -413,16 +414,17 @@ check_requirements() {
         missing_tools+=("docker")
     fi
 
-    if [[ "$CHECK_DIGESTS" == "true" ]] && ! command -v jq >/dev/null 2>&1; then
+    if ! command -v jq >/dev/null 2>&1; then
         missing_tools+=("jq")
     fi
 
+    if ! command -v python3 >/dev/null 2>&1; then
+        missing_tools+=("python3")
+    fi
+
     if [[ ${#missing_tools[@]} -gt 0 ]]; then
         log_error "Missing required tools: ${missing_tools[*]}"
         log_error "Please install the missing tools and try again"
-        if [[ "$CHECK_DIGESTS" == "true" ]]; then
-            log_error "Note: jq is required for digest comparison (-c/--check-digests)"
-        fi
         exit 1
     fi
 }
@@ -438,6 +440,7 @@ usage() {
     echo "  -d, --dry-run          Only check, don't actually push images"
     echo "  -v, --verbose          Enable verbose output"
     echo "  -c, --check-digests    Compare layer digests between remote and local images"
+    echo "  -m, --digest-mode MODE config (default), repo-digests or pull"
     echo "  -h, --help             Show this help message"
     echo
     echo "Environment variables:"
@@ -445,6 +448,8 @@ usage() {
     echo "  DRY_RUN              Set to 'true' for dry run mode"
     echo "  VERBOSE              Set to 'true' for verbose output"
     echo "  CHECK_DIGESTS        Set to 'true' to compare layer digests"
+    echo "  DIGEST_MODE          config (default), repo-digests or pull"
+    echo "  REPORT_FILE          Path of the JSON report of the registry check"
     echo
     echo "Example usage:"
     echo "  $0                           # Use default images.lst"
@@ -478,6 +483,10 @@ while [[ $# -gt 0 ]]; do
             CHECK_DIGESTS="true"
             shift
             ;;
+        -m|--digest-mode)
+            DIGEST_MODE="$2"
+            shift 2
+            ;;
         -h|--help)
             usage
             exit 0
@@ -2,16 +2,43 @@
 
 # SPDX-License-Identifier: Apache-2.0
 
-import io
+"""
+Add the digests of the local images to <LIST>.yml.
+
+CHECKSUM_DIGEST_MODE selects how the digests are computed:
+
+    skopeo  run skopeo inspect per image (default)
+    daemon  compute the digests from a single docker save of all images
+
+Neither mode contacts a registry. skopeo inspect docker-daemon: exports
+the whole image from the Docker daemon, once per image, so a layer shared by
+many images is read once for each of them. The daemon mode reads a single
+docker save of all listed images, in which every shared layer is stored
+once, but it is one sequential stream (tens of GB for a Kolla image set)
+without the parallel jobs and the retries per image of the skopeo mode.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
 import os
 import subprocess
 import sys
+import time
 
+from docker import DockerClient
 from loguru import logger
 import json
 import yaml
 
+import image_digest
+
 LIST = os.environ.get("LIST", "openstack")
+CHECKSUM_PARALLEL_JOBS = int(os.environ.get("CHECKSUM_PARALLEL_JOBS", "8"))
+CHECKSUM_TIMEOUT = int(os.environ.get("CHECKSUM_TIMEOUT", "300"))
+CHECKSUM_RETRIES = int(os.environ.get("CHECKSUM_RETRIES", "3"))
+
+# skopeo: run skopeo inspect per image
+# daemon: compute the digests from a single docker save of all images
+CHECKSUM_DIGEST_MODE = os.environ.get("CHECKSUM_DIGEST_MODE", "skopeo")
 
 level = "INFO"
 log_fmt = (
@@ -22,22 +49,81 @@ log_fmt = (
 logger.remove()
 logger.add(sys.stderr, format=log_fmt, level=level, colorize=True)
 
+
+def get_digest(name):
+    """
+    Get the digest of a local image with skopeo.
+
+    The command is retried CHECKSUM_RETRIES times, each attempt is aborted
+    after CHECKSUM_TIMEOUT seconds.
+
+    Args:
+        name: Image reference in the Docker daemon
+
+    Returns:
+        Tuple of the digest and None, or None and the error of the last attempt
+    """
+    error = None
+    for attempt in range(1, CHECKSUM_RETRIES + 1):
+        logger.info(f"Processing {name} (attempt {attempt}/{CHECKSUM_RETRIES})")
+        try:
+            # NOTE: run reads stdout and stderr while waiting for the process,
+            #       a large output can not block it.
+            p = subprocess.run(
+                ["skopeo", "inspect", f"docker-daemon:{name}"],
+                capture_output=True,
+                text=True,
+                timeout=CHECKSUM_TIMEOUT,
+            )
+            if p.returncode == 0:
+                return json.loads(p.stdout)["Digest"], None
+            error = f"exit code {p.returncode}: {p.stderr.strip()}"
+        except subprocess.TimeoutExpired:
+            error = f"timeout after {CHECKSUM_TIMEOUT}s"
+        except (OSError, ValueError, KeyError) as e:
+            error = str(e)
+
+        logger.warning(f"skopeo inspect of {name} failed, {error}")
+        if attempt < CHECKSUM_RETRIES:
+            time.sleep(2**attempt)
+
+    return None, error
+
+
 with open(f"{LIST}.yml") as fp:
     data = yaml.load(fp, Loader=yaml.SafeLoader)
 
 images = data.get("images", {})
-for image in images:
-    logger.info(f"Processing {image['image']}")
-    p = subprocess.Popen(
-        f"skopeo inspect docker-daemon:{image['image']}",
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-    )
-    p.wait()
-    stdout = io.TextIOWrapper(p.stdout, encoding="utf-8")
-    result = json.loads(stdout.read())
-    image["digest"] = result["Digest"]
+
+names = [image["image"] for image in images]
+
+if CHECKSUM_DIGEST_MODE == "daemon":
+    try:
+        digests = image_digest.compute_digests(DockerClient(), names)
+    except Exception as e:
+        logger.error(f"Computing the digests from the Docker daemon failed: {e}")
+        sys.exit(1)
+    results = [
+        (digests[name], None) if name in digests else (None, "not exported")
+        for name in names
+    ]
+else:
+    with ThreadPoolExecutor(max_workers=CHECKSUM_PARALLEL_JOBS) as executor:
+        results = list(executor.map(get_digest, names))
+
+failed = []
+for image, (digest, error) in zip(images, results):
+    if digest:
+        image["digest"] = digest
+    else:
+        failed.append(image["image"])
+        logger.error(f"No digest for {image['image']}: {error}")
+
+if failed:
+    logger.error(f"Failed to get the digests of {len(failed)} images:")
+    for name in failed:
+        logger.error(f"  {name}")
+    sys.exit(1)
 
 with open(f"{LIST}.yml", "w+") as fp:
     fp.write(yaml.dump(data))
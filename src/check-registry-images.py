@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Check which images of an images file exist on their registries.
+
+The manifest of every image is fetched once through the registry API and
+kept for the run, the checks run concurrently over the pooled connections
+of a single registry client.
+
+With --check-digests, the remote images are compared with the local images
+without pulling them:
+
+    config        the ID of the local image is compared with the config
+                  digest of the remote manifest. If they differ, the config
+                  blob (a few KB) is fetched and its layer DiffIDs are
+                  compared with those of the local image, to tell images
+                  with different layers from images with a different config
+                  only. No layer is downloaded.
+    repo-digests  the digest the tag points to is compared with the repo
+                  digests of the local image, images that were not pushed
+                  from this host are not compared.
+
+Images that differ are reported as mismatch.
+
+The result is written as a JSON report:
+
+    {
+      "created": "...",
+      "images_file": "images.lst",
+      "summary": {"exists": 2, "missing": 1, "mismatch": 0, "error": 0},
+      "images": [
+        {
+          "image": "...",
+          "status": "exists",
+          "digest": "sha256:...",
+          "config_digest": "sha256:...",
+          "local": true,
+          "local_id": "sha256:...",
+          "local_digests": ["sha256:..."],
+          "digest_match": true,
+          "diff_ids_match": true,
+          "error": null
+        }
+      ]
+    }
+
+digest_match is null if the digests were not compared, e.g. because the
+image is not available locally. diff_ids_match is only set by the config
+mode.
+
+Exit codes:
+    0: All images exist (and match, with --check-digests)
+    1: Missing images, mismatches or registry errors
+    2: Fatal errors (images file not found, etc.)
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+from typing import Dict, List, Optional
+
+from docker import DockerClient
+from docker.errors import DockerException, ImageNotFound
+from loguru import logger
+from requests.exceptions import RequestException
+
+import registry
+
+IMAGES_FILE = os.environ.get("IMAGES_FILE", "images.lst")
+REGISTRY_CHECK_PARALLEL_JOBS = int(os.environ.get("REGISTRY_CHECK_PARALLEL_JOBS", "8"))
+REGISTRY_CHECK_DIGEST_MODE = os.environ.get("REGISTRY_CHECK_DIGEST_MODE", "config")
+
+STATUSES = ["exists", "missing", "mismatch", "error"]
+
+# Configure logger
+logger.remove()
+log_fmt = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | "
+    "<level>{message}</level>"
+)
+logger.add(sys.stderr, format=log_fmt)
+
+
+def read_images(path: str) -> List[str]:
+    """
+    Read an images file, one image per line.
+
+    Empty lines and comments are skipped, every image is returned once.
+    """
+    images = []
+    with open(path) as fp:
+        for line in fp:
+            image = "".join(line.split())
+            if not image or image.startswith("#"):
+                continue
+            if image not in images:
+                images.append(image)
+
+    return images
+
+
+def repository_name(image: str) -> str:
+    """
+    Strip the tag or digest of an image reference, e.g.
+    "quay.io/osism/nova-api:2025.1" -> "quay.io/osism/nova-api".
+    """
+    if "@" in image:
+        return image.split("@", 1)[0]
+    if ":" in image.split("/")[-1]:
+        return image.rsplit(":", 1)[0]
+    return image
+
+
+class ManifestCache:
+    """
+    Manifests of the checked images, each fetched at most once per run.
+    """
+
+    def __init__(self, client: registry.RegistryClient):
+        self.client = client
+        self.manifests = {}
+        self.configs = {}
+
+    def get(self, image: str) -> Optional[Dict]:
+        """
+        Fetch the manifest of an image.
+
+        Returns:
+            Dictionary with the manifest, its digest and the digest the tag
+            points to, or None if the image does not exist
+
+        Raises:
+            RegistryError: The registry returned an error
+        """
+        if image not in self.manifests:
+            try:
+                manifest, digest, reference_digest = self.client.resolve_manifest(image)
+                self.manifests[image] = {
+                    "manifest": manifest,
+                    "digest": digest,
+                    "reference_digest": reference_digest,
+                }
+            except registry.NotFoundError:
+                self.manifests[image] = None
+
+        return self.manifests[image]
+
+    def config(self, image: str, digest: str) -> Dict:
+        """
+        Fetch the config blob of an image, only the blob is downloaded.
+
+        Images sharing a config are fetched once.
+
+        Raises:
+            RegistryError: The registry returned an error or the blob does
+                not match its digest
+        """
+        if digest not in self.configs:
+            with self.client.open_blob(image, digest) as response:
+                data = response.content
+
+            if f"sha256:{hashlib.sha256(data).hexdigest()}" != digest:
+                raise registry.RegistryError(f"Digest mismatch of blob {digest}")
+            self.configs[digest] = json.loads(data)
+
+        return self.configs[digest]
+
+
+def local_repo_digests(attrs: Dict, image: str) -> List[str]:
+    """
+    Digests of the local image in the repository of the image reference,
+    from the RepoDigests of the local image.
+    """
+    name = repository_name(image)
+    return [
+        repo_digest.split("@", 1)[1]
+        for repo_digest in attrs.get("RepoDigests") or []
+        if repo_digest.split("@", 1)[0] == name
+    ]
+
+
+def compare_config(cache: ManifestCache, image: str, entry: Dict, attrs: Dict):
+    """
+    Compare a local image with the manifest and config blob of the remote
+    image.
+
+    The ID of a local image is the digest of its config, or the digest of
+    its manifest with the containerd image store.
+
+    Returns:
+        Tuple of digest_match and diff_ids_match
+    """
+    if attrs["Id"] in (
+        entry["manifest"].get("config", {}).get("digest"),
+        entry["digest"],
+        entry["reference_digest"],
+    ):
+        return True, True
+
+    config = cache.config(image, entry["manifest"]["config"]["digest"])
+    diff_ids = config.get("rootfs", {}).get("diff_ids", [])
+    return False, diff_ids == attrs.get("RootFS", {}).get("Layers", [])
+
+
+def check_image(
+    cache: ManifestCache, docker_client, digest_mode: str, image: str
+) -> Dict:
+    """
+    Check if an image exists on its registry and, with a Docker client, if
+    the local image matches it.
+
+    Args:
+        cache: Manifests of the checked images
+        docker_client: Docker client, None to skip the comparison
+        digest_mode: config or repo-digests
+        image: Image reference
+
+    Returns:
+        Entry of the report for the image
+    """
+    result = {
+        "image": image,
+        "status": "missing",
+        "digest": None,
+        "config_digest": None,
+        "local": None,
+        "local_id": None,
+        "local_digests": None,
+        "digest_match": None,
+        "diff_ids_match": None,
+        "error": None,
+    }
+
+    try:
+        entry = cache.get(image)
+    except (registry.RegistryError, RequestException, ValueError) as e:
+        logger.error(f"Checking {image} failed: {e}")
+        result["status"] = "error"
+        result["error"] = str(e)
+        return result
+
+    if entry is None:
+        logger.warning(f"MISSING: {image}")
+        return result
+
+    result["status"] = "exists"
+    result["digest"] = entry["reference_digest"]
+    result["config_digest"] = entry["manifest"].get("config", {}).get("digest")
+
+    if docker_client is None:
+        logger.info(f"EXISTS: {image}")
+        return result
+
+    try:
+        attrs = docker_client.api.inspect_image(image)
+    except ImageNotFound:
+        attrs = None
+
+    result["local"] = attrs is not None
+    if attrs is None:
+        logger.info(f"EXISTS: {image} (not available locally)")
+        return result
+
+    result["local_id"] = attrs["Id"]
+    result["local_digests"] = local_repo_digests(attrs, image)
+
+    if digest_mode == "config":
+        try:
+            result["digest_match"], result["diff_ids_match"] = compare_config(
+                cache, image, entry, attrs
+            )
+        except (registry.RegistryError, RequestException, ValueError, KeyError) as e:
+            logger.error(f"Comparing the config of {image} failed: {e}")
+            result["status"] = "error"
+            result["error"] = str(e)
+            return result
+
+    # NOTE: Without repo digests the local image was never pushed to or
+    #       pulled from this repository, there is nothing to compare with.
+    elif result["local_digests"]:
+        result["digest_match"] = entry["reference_digest"] in result["local_digests"]
+
+    if result["digest_match"] is False:
+        result["status"] = "mismatch"
+        if digest_mode == "config":
+            difference = "layers" if not result["diff_ids_match"] else "config"
+            logger.warning(
+                f"DIGEST MISMATCH: {image} differs in its {difference}, "
+                f"{result['config_digest']} on the registry, {attrs['Id']} locally"
+            )
+        else:
+            logger.warning(
+                f"DIGEST MISMATCH: {image} is {entry['reference_digest']} on the "
+                f"registry, {', '.join(result['local_digests'])} locally"
+            )
+        return result
+
+    logger.info(f"EXISTS: {image}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check which images of an images file exist on their registries",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Exit codes:
+  0 - All images exist (and match, with --check-digests)
+  1 - Missing images, mismatches or registry errors
+  2 - Fatal errors (images file not found, etc.)
+""",
+    )
+    parser.add_argument(
+        "--images-file",
+        "-f",
+        type=str,
+        default=IMAGES_FILE,
+        help="Images file to check (default: images.lst, env: IMAGES_FILE)",
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        default=None,
+        help="Write the JSON report to this file instead of stdout",
+    )
+    parser.add_argument(
+        "--parallel-jobs",
+        "-j",
+        type=int,
+        default=REGISTRY_CHECK_PARALLEL_JOBS,
+        help="Number of concurrent checks "
+        "(default: 8, env: REGISTRY_CHECK_PARALLEL_JOBS)",
+    )
+    parser.add_argument(
+        "--check-digests",
+        action="store_true",
+        default=False,
+        help="Compare the remote images with the local images, without " "pulling them",
+    )
+    parser.add_argument(
+        "--digest-mode",
+        choices=["config", "repo-digests"],
+        default=REGISTRY_CHECK_DIGEST_MODE,
+        help="Compare the config digests and layer DiffIDs or the repo digests "
+        "(default: config, env: REGISTRY_CHECK_DIGEST_MODE)",
+    )
+    args = parser.parse_args()
+
+    if args.parallel_jobs < 1:
+        parser.error("--parallel-jobs must be at least 1")
+
+    try:
+        images = read_images(args.images_file)
+    except OSError as e:
+        logger.error(f"Failed to read {args.images_file}: {e}")
+        sys.exit(2)
+
+    docker_client = None
+    if args.check_digests:
+        try:
+            docker_client = DockerClient(max_pool_size=args.parallel_jobs)
+        except DockerException as e:
+            logger.error(f"Failed to connect to the Docker daemon: {e}")
+            sys.exit(2)
+
+    logger.info(
+        f"Checking {len(images)} images with {args.parallel_jobs} parallel jobs"
+    )
+    cache = ManifestCache(registry.RegistryClient(pool_size=args.parallel_jobs))
+    with ThreadPoolExecutor(max_workers=args.parallel_jobs) as executor:
+        results = list(
+            executor.map(
+                partial(check_image, cache, docker_client, args.digest_mode), images
+            )
+        )
+
+    summary = {status: 0 for status in STATUSES}
+    for result in results:
+        summary[result["status"]] += 1
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "images_file": args.images_file,
+        "summary": summary,
+        "images": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2)
+            fp.write("\n")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    logger.info(
+        ", ".join(f"{summary[status]} {status}" for status in STATUSES)
+        + f" of {len(results)} images"
+    )
+
+    sys.exit(0 if summary["exists"] == len(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
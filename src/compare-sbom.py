@@ -9,13 +9,19 @@ This script compares:
 2. Version presence (warnings for removed components, info for added components)
 3. Version downgrades (errors when current version < last version)
 
-The script pulls the SBOM from a remote container registry and compares it
-with a local SBOM file. The OpenStack version can be configured via
+The script reads the SBOM from a remote container registry and compares it
+with a local SBOM file. By default only the layer with images.yml is fetched
+through the registry API, with --fetch-method docker the image is pulled with
+the Docker daemon instead. The OpenStack version can be configured via
 --openstack-version or the OPENSTACK_VERSION environment variable.
 
 Alternatively, use --list-remote to only list the remote SBOM contents without
 loading a local SBOM or performing any comparison.
 
+With --history, any number of SBOMs (files or image references) are compared
+in the given order, each one with its predecessor, and a JSON or YAML diff
+document with the version history of every component is written.
+
 Exit codes:
     0: Success (no failures based on configured fail conditions)
     1: One or more configured fail conditions triggered
@@ -23,18 +29,27 @@ Exit codes:
 """
 
 import argparse
+import io
+import json
 import os
 import subprocess
 import sys
-import tempfile
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 from docker import DockerClient
 from docker.errors import DockerException, ImageNotFound, APIError
 from loguru import logger
 from packaging.version import Version, InvalidVersion
-from yaml import safe_load, YAMLError
+from requests.exceptions import RequestException
+from yaml import dump, safe_load, YAMLError
+
+import registry
+import sbom_diff
+from sbom_diff import extract_image_name, strip_date_postfix
 
 # Configure logger
 logger.remove()
@@ -121,53 +136,6 @@ def get_excluded_images_from_commit() -> Set[str]:
     return excluded_images
 
 
-def strip_date_postfix(version_string: str) -> str:
-    """
-    Strip date postfix from version string.
-
-    Example: "20.0.0.20251020" -> "20.0.0"
-
-    Args:
-        version_string: Version string potentially with date postfix
-
-    Returns:
-        Version string without date postfix
-    """
-    parts = version_string.split(".")
-
-    # Find first part that looks like a date (8 digits starting with 20)
-    cleaned_parts = []
-    for part in parts:
-        if len(part) == 8 and part.startswith("20"):
-            # This looks like a date (YYYYMMDD), stop here
-            break
-        cleaned_parts.append(part)
-
-    return ".".join(cleaned_parts) if cleaned_parts else version_string
-
-
-def extract_image_name(image_path: str) -> str:
-    """
-    Extract service name from full image path.
-
-    Example: "osism.harbor.regio.digital/kolla/ovn-sb-db-relay:25.3.1.20251020"
-             -> "ovn-sb-db-relay"
-
-    Args:
-        image_path: Full image path with registry, repository and tag
-
-    Returns:
-        Service name (between last '/' and ':')
-    """
-    # Split by '/' to get the last part (image:tag)
-    image_with_tag = image_path.split("/")[-1]
-
-    # Split by ':' to get just the image name
-    image_name = image_with_tag.split(":")[0]
-
-    return image_name
-
-
 def load_sbom_from_file(file_path: Path) -> Dict:
     """
     Load SBOM data from YAML file.
@@ -206,6 +174,58 @@ def load_sbom_from_file(file_path: Path) -> Dict:
         sys.exit(2)
 
 
+class ChunkStream(io.RawIOBase):
+    """
+    Read-only file object over an iterator of byte chunks.
+
+    Example: ChunkStream(container.get_archive(path)[0])
+    """
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self.chunks = iter(chunks)
+        self.buffer = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self.buffer:
+            try:
+                self.buffer = next(self.chunks)
+            except StopIteration:
+                return 0
+
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+
+def read_yaml_from_tar_stream(chunks: Iterator[bytes], name: str) -> Dict:
+    """
+    Parse a YAML file from a tar archive given as a stream of chunks.
+
+    The archive is read sequentially and reading stops as soon as the file
+    was extracted, only the current chunk is held in memory.
+
+    Args:
+        chunks: Chunks of the tar archive, e.g. from container.get_archive
+        name: Name of the file in the archive
+
+    Returns:
+        Parsed YAML data
+
+    Raises:
+        FileNotFoundError: If the archive does not contain the file
+    """
+    with tarfile.open(fileobj=ChunkStream(chunks), mode="r|") as tar:
+        for member in tar:
+            if member.name.lstrip("/") == name and member.isfile():
+                return safe_load(tar.extractfile(member).read().decode("utf-8"))
+
+    raise FileNotFoundError(f"{name} not found in tar archive")
+
+
 def load_sbom_from_container(image_ref: str) -> Optional[Dict]:
     """
     Pull container image and extract SBOM file.
@@ -257,27 +277,13 @@ def load_sbom_from_container(image_ref: str) -> Optional[Dict]:
         logger.info("Creating temporary container...")
         container = client.containers.create(image_ref, command="true")
 
-        with tempfile.NamedTemporaryFile(mode="w+b", delete=False) as tmp_file:
-            logger.info("Extracting images.yml from container...")
-
-            # Get the file from container
-            bits, stat = container.get_archive("/images.yml")
-
-            # Write tar archive to temp file
-            for chunk in bits:
-                tmp_file.write(chunk)
-            tmp_file.flush()
+        logger.info("Extracting images.yml from container...")
 
-            # Extract YAML from tar
-            import tarfile
+        # Get the file from container
+        bits, stat = container.get_archive("/images.yml")
 
-            tmp_file.seek(0)
-            with tarfile.open(fileobj=tmp_file) as tar:
-                yaml_file = tar.extractfile("images.yml")
-                if yaml_file:
-                    sbom = safe_load(yaml_file.read().decode("utf-8"))
-                else:
-                    raise FileNotFoundError("images.yml not found in tar archive")
+        # Extract YAML from the tar stream, without buffering the archive
+        sbom = read_yaml_from_tar_stream(bits, "images.yml")
 
         logger.success("Successfully extracted SBOM from container")
 
@@ -311,6 +317,139 @@ def load_sbom_from_container(image_ref: str) -> Optional[Dict]:
     return sbom
 
 
+class SbomCache:
+    """
+    On-disk cache of remote SBOM files, keyed by the manifest digest.
+
+    Every SBOM is stored as one file named after the digest. The least
+    recently used files are evicted once the total size of the cache exceeds
+    max_size bytes.
+    """
+
+    def __init__(self, directory: Path, max_size: int):
+        self.directory = directory
+        self.max_size = max_size
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, digest: str) -> Path:
+        return self.directory / (digest.replace(":", "-") + ".yml")
+
+    def get(self, digest: str) -> Optional[bytes]:
+        path = self._path(digest)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+
+        # the modification time is the last use, it decides the eviction
+        path.touch()
+        return data
+
+    def put(self, digest: str, data: bytes) -> None:
+        path = self._path(digest)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+
+        files = sorted(
+            self.directory.glob("*.yml"),
+            key=lambda x: x.stat().st_mtime,
+            reverse=True,
+        )
+        total = 0
+        for file in files:
+            total += file.stat().st_size
+            if total > self.max_size and file != path:
+                logger.info(f"Evicting {file.name} from the SBOM cache")
+                file.unlink(missing_ok=True)
+
+
+def load_sbom_from_registry(
+    image_ref: str, cache: Optional[SbomCache] = None
+) -> Optional[Dict]:
+    """
+    Read the SBOM file from the layers of an image through the registry API.
+
+    Only the manifest and the layer blob containing images.yml are fetched,
+    no Docker daemon is required. With a cache, the digest of the manifest is
+    checked with a HEAD request first and nothing else is transferred if the
+    SBOM of that digest is in the cache.
+
+    Args:
+        image_ref: Container image reference (e.g., "registry.osism.cloud/kolla/sbom:2025.1")
+        cache: Cache of previously fetched SBOM files
+
+    Returns:
+        Parsed SBOM data dictionary, or None if the image does not exist
+
+    Raises:
+        registry.RegistryError: If the registry cannot be used
+        SystemExit: If the image does not contain a valid SBOM
+    """
+    logger.info(f"Fetching images.yml of {image_ref} from the registry")
+
+    client = registry.RegistryClient()
+    try:
+        data = None
+        if cache:
+            digest = client.head_manifest(image_ref)
+            data = cache.get(digest)
+            if data is not None:
+                logger.info(f"Using cached SBOM of {digest}")
+            else:
+                # NOTE: The digest is used for the download, the tag could be
+                #       moved in the meantime.
+                data = client.read_file(
+                    registry.with_digest(image_ref, digest), "/images.yml"
+                )
+                if data is not None:
+                    cache.put(digest, data)
+        else:
+            data = client.read_file(image_ref, "/images.yml")
+    except registry.NotFoundError:
+        logger.warning(f"Image not found: {image_ref}")
+        return None
+
+    if data is None:
+        logger.error(f"File not found in image: images.yml in {image_ref}")
+        sys.exit(2)
+
+    try:
+        sbom = safe_load(data.decode("utf-8"))
+    except YAMLError as e:
+        logger.error(f"YAML parsing error: {e}")
+        sys.exit(2)
+
+    logger.success("Successfully fetched SBOM from the registry")
+    return sbom
+
+
+def load_remote_sbom(
+    image_ref: str, fetch_method: str, cache: Optional[SbomCache] = None
+) -> Optional[Dict]:
+    """
+    Load the remote SBOM with the configured fetch method.
+
+    If the registry API cannot be used, e.g. because of an unsupported
+    authentication, the image is pulled with the Docker daemon.
+
+    Args:
+        image_ref: Container image reference
+        fetch_method: "registry" or "docker"
+        cache: Cache of previously fetched SBOM files, registry only
+
+    Returns:
+        Parsed SBOM data dictionary, or None if the image does not exist
+    """
+    if fetch_method == "registry":
+        try:
+            return load_sbom_from_registry(image_ref, cache)
+        except (registry.RegistryError, RequestException, tarfile.TarError) as e:
+            logger.warning(f"Fetching from the registry failed, using Docker: {e}")
+
+    return load_sbom_from_container(image_ref)
+
+
 def extract_image_names(sbom: Dict) -> Set[str]:
     """
     Extract set of image names from SBOM.
@@ -422,6 +561,78 @@ def compare_version_presence(
     return removed, added
 
 
+def load_sbom_source(
+    source: str, fetch_method: str, cache: Optional[SbomCache] = None
+) -> Optional[Dict]:
+    """
+    Load an SBOM from a file if the path exists, else from an image.
+
+    Args:
+        source: Path to an images.yml file or container image reference
+        fetch_method: "registry" or "docker"
+        cache: Cache of previously fetched SBOM files
+
+    Returns:
+        Parsed SBOM data dictionary, or None if the image does not exist
+    """
+    if Path(source).exists():
+        return load_sbom_from_file(Path(source))
+
+    return load_remote_sbom(source, fetch_method, cache)
+
+
+def write_history(
+    sources: List[str],
+    fetch_method: str,
+    cache: Optional[SbomCache],
+    output: str,
+    output_format: str,
+) -> Dict:
+    """
+    Compare a series of SBOMs and write the diff document.
+
+    Args:
+        sources: Files or image references of the SBOMs, oldest first
+        fetch_method: "registry" or "docker"
+        cache: Cache of previously fetched SBOM files
+        output: Path of the diff document, "-" for stdout
+        output_format: "json" or "yaml"
+
+    Returns:
+        Diff document as returned by sbom_diff.diff_history
+    """
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        sboms = list(
+            executor.map(
+                partial(load_sbom_source, fetch_method=fetch_method, cache=cache),
+                sources,
+            )
+        )
+
+    snapshots = []
+    for source, sbom in zip(sources, sboms):
+        if sbom is None:
+            logger.warning(f"Skipping missing SBOM {source}")
+            continue
+        snapshots.append((source, sbom))
+
+    document = sbom_diff.diff_history(snapshots)
+
+    if output_format == "json":
+        data = json.dumps(document, indent=2) + "\n"
+    else:
+        data = dump(document, default_flow_style=False, sort_keys=False)
+
+    if output == "-":
+        sys.stdout.write(data)
+    else:
+        with open(output, "w") as fp:
+            fp.write(data)
+        logger.info(f"Wrote diff of {len(snapshots)} SBOMs to {output}")
+
+    return document
+
+
 def list_sbom(sbom: Dict) -> None:
     """
     List contents of an SBOM.
@@ -468,6 +679,30 @@ Exit codes:
         help="Only list remote SBOM contents without comparing to local SBOM",
     )
 
+    parser.add_argument(
+        "--history",
+        nargs="+",
+        metavar="SBOM",
+        default=None,
+        help="Compare these SBOMs (files or image references, oldest first) with "
+        "each other and write a diff document instead of comparing the local SBOM",
+    )
+
+    parser.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        default="-",
+        help="Path of the diff document of --history (default: stdout)",
+    )
+
+    parser.add_argument(
+        "--output-format",
+        choices=["json", "yaml"],
+        default="json",
+        help="Format of the diff document of --history (default: json)",
+    )
+
     parser.add_argument(
         "--local-sbom",
         "-l",
@@ -491,6 +726,37 @@ Exit codes:
         help="Remote SBOM container image reference (default: registry.osism.cloud/kolla/sbom:<openstack-version>)",
     )
 
+    parser.add_argument(
+        "--fetch-method",
+        choices=["registry", "docker"],
+        default=os.environ.get("SBOM_FETCH_METHOD", "registry"),
+        help="Fetch images.yml through the registry API or pull the remote image "
+        "with Docker (default: registry, env: SBOM_FETCH_METHOD)",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=os.environ.get("SBOM_CACHE_DIR", ".sbom-cache"),
+        help="Directory of the cache of remote SBOMs fetched through the registry "
+        "API (default: .sbom-cache, env: SBOM_CACHE_DIR)",
+    )
+
+    parser.add_argument(
+        "--cache-max-size",
+        type=int,
+        default=int(os.environ.get("SBOM_CACHE_MAX_SIZE", str(64 * 1024 * 1024))),
+        help="Maximum size of the SBOM cache in bytes "
+        "(default: 64 MiB, env: SBOM_CACHE_MAX_SIZE)",
+    )
+
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        default=False,
+        help="Always fetch the remote SBOM, do not use or fill the cache",
+    )
+
     parser.add_argument(
         "--fail-on-image-removed",
         action="store_true",
@@ -532,6 +798,41 @@ Exit codes:
     if args.remote_image is None:
         args.remote_image = f"registry.osism.cloud/kolla/sbom:{args.openstack_version}"
 
+    # NOTE: The cache is only used by the registry fetch method, the
+    #       directory is not created for the docker fetch method.
+    cache = None
+    if args.fetch_method == "registry" and not args.no_cache:
+        try:
+            cache = SbomCache(Path(args.cache_dir), args.cache_max_size)
+        except OSError as e:
+            logger.warning(f"SBOM cache {args.cache_dir} not usable: {e}")
+
+    # Handle --history mode
+    if args.history:
+        try:
+            document = write_history(
+                args.history,
+                args.fetch_method,
+                cache,
+                args.output,
+                args.output_format,
+            )
+        except SystemExit:
+            raise
+        except Exception as e:
+            logger.error(f"Unexpected error comparing the SBOM history: {e}")
+            sys.exit(2)
+
+        downgrades = document["summary"]["downgrades"]
+        if downgrades:
+            log_level = (
+                logger.error if args.fail_on_version_downgrade else logger.warning
+            )
+            log_level(f"Version downgrades in the SBOM history: {downgrades}")
+            if args.fail_on_version_downgrade:
+                sys.exit(1)
+        sys.exit(0)
+
     # Handle --list-remote mode
     if args.list_remote:
         logger.info("Listing remote SBOM contents")
@@ -539,7 +840,7 @@ Exit codes:
         logger.info(f"Remote image: {args.remote_image}")
 
         try:
-            remote = load_sbom_from_container(args.remote_image)
+            remote = load_remote_sbom(args.remote_image, args.fetch_method, cache)
         except SystemExit:
             raise
         except Exception as e:
@@ -563,10 +864,14 @@ Exit codes:
     logger.info(f"Local SBOM: {local_sbom_path}")
     logger.info(f"Remote image: {args.remote_image}")
 
-    # Load SBOMs
+    # Load SBOMs, the local file is read while the remote image is pulled
     try:
-        local = load_sbom_from_file(local_sbom_path)
-        remote = load_sbom_from_container(args.remote_image)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            remote_future = executor.submit(
+                load_remote_sbom, args.remote_image, args.fetch_method, cache
+            )
+            local = load_sbom_from_file(local_sbom_path)
+            remote = remote_future.result()
     except SystemExit:
         raise
     except Exception as e:
@@ -0,0 +1,100 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Bounded thread pool for the stages talking to the Docker daemon.
+
+The calls of docker-py are blocking. They run in a thread pool with as many
+workers as the connection pool of the client has connections, so the
+round-trips to the daemon for many images overlap instead of adding up. The
+results are always returned in the order of the calls.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+from docker.errors import ImageNotFound
+from loguru import logger
+
+T = TypeVar("T")
+
+
+def _capture(call: Callable[[], T]) -> Tuple[Optional[BaseException], Optional[T]]:
+    # NOTE: Exceptions, including SystemExit of the stage scripts, are kept
+    #       and raised again once all calls are done.
+    try:
+        return None, call()
+    except BaseException as e:
+        return e, None
+
+
+def gather(calls: List[Callable[[], T]], limit: int) -> List[T]:
+    """
+    Run blocking calls concurrently.
+
+    Args:
+        calls: Callables without arguments, e.g. functools.partial objects
+        limit: Maximum number of calls running at the same time, should not
+            exceed the max_pool_size of the Docker client
+
+    Returns:
+        Results of the calls, in the order of the calls
+
+    Raises:
+        The exception of the first failed call, after all calls are done
+    """
+    if not calls:
+        return []
+
+    with ThreadPoolExecutor(max_workers=limit) as executor:
+        outcomes = list(executor.map(_capture, calls))
+
+    for error, _ in outcomes:
+        if error is not None:
+            raise error
+
+    return [result for _, result in outcomes]
+
+
+def _get_image(client, image_id: str, durations: Dict[str, float]):
+    start = time.monotonic()
+    try:
+        return client.images.get(image_id)
+    except ImageNotFound:
+        logger.debug(f"Image {image_id} was removed while listing the images")
+        return None
+    finally:
+        durations[image_id] = time.monotonic() - start
+
+
+def list_images(
+    client,
+    filters: Optional[Dict],
+    limit: int,
+    durations: Optional[Dict[str, float]] = None,
+) -> List:
+    """
+    List images like client.images.list, inspecting the images concurrently.
+
+    client.images.list inspects every listed image one after the other, with
+    200+ images this is the slowest part of listing them.
+
+    Args:
+        client: Docker client
+        filters: Filters as accepted by client.images.list
+        limit: Maximum number of concurrent inspect calls
+        durations: Filled with the duration of the inspect call per image ID
+
+    Returns:
+        Images in the order returned by the daemon
+    """
+    if durations is None:
+        durations = {}
+
+    image_ids = [image["Id"] for image in client.api.images(filters=filters)]
+    images = gather(
+        [partial(_get_image, client, image_id, durations) for image_id in image_ids],
+        limit,
+    )
+    return [image for image in images if image]
@@ -0,0 +1,93 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Run several generators of src/generators.py in one process.
+
+The release metadata is loaded once and shared by all generators. Every
+generator option writes the output of one generator to the given path.
+
+--merge-repos merges the repos.yaml overlay first, like merge-repos-yaml.py.
+--set changes an option of the generated kolla-build.conf the way the
+ini_file module of Ansible does, without starting Ansible for every option.
+"""
+
+import argparse
+import sys
+
+import generators
+import release_metadata
+
+GENERATORS = {
+    "kolla_build_config": generators.kolla_build_config,
+    "apt_preferences": generators.apt_preferences,
+    "template_overrides": generators.template_overrides,
+    "projects": generators.projects,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate the files derived from the release metadata"
+    )
+    parser.add_argument(
+        "--merge-repos",
+        nargs=2,
+        metavar=("OVERLAY", "DESTINATION"),
+        default=None,
+        help="Merge the repos.yaml OVERLAY into DESTINATION",
+    )
+    for name in GENERATORS:
+        option = name.replace("_", "-")
+        parser.add_argument(
+            f"--{option}",
+            dest=name,
+            metavar="PATH",
+            default=None,
+            help=f"Write the output of the {option} generator to PATH",
+        )
+    parser.add_argument(
+        "--set",
+        nargs=3,
+        action="append",
+        default=[],
+        metavar=("SECTION", "OPTION", "VALUE"),
+        help="Set an option of the generated kolla-build.conf, can be repeated",
+    )
+    args = parser.parse_args()
+
+    if args.set and not args.kolla_build_config:
+        parser.error("--set requires --kolla-build-config")
+
+    if args.merge_repos:
+        generators.merge_repos(*args.merge_repos)
+
+    if not any(getattr(args, name) for name in GENERATORS):
+        return
+
+    versions = release_metadata.load(generators.OPENSTACK_VERSION)
+
+    for name, generator in GENERATORS.items():
+        path = getattr(args, name)
+        if path is None:
+            continue
+
+        try:
+            result = generator(versions)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+
+        if name == "kolla_build_config":
+            lines = (result + "\n").splitlines(keepends=True)
+            for section, option, value in args.set:
+                lines = generators.set_option(lines, section, option, value)
+            result = "".join(lines)
+        else:
+            result += "\n"
+
+        with open(path, "w") as fp:
+            fp.write(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,423 @@
 # SPDX-License-Identifier: Apache-2.0
 
+"""
+Generate an SPDX SBOM with syft for every image listed in images.yml.
+
+syft needs a lot of memory for large images. The runs are limited by
+SYFT_PARALLEL_JOBS and are only admitted while the available memory of the
+host (MemAvailable of /proc/meminfo) minus the expected memory of the running
+jobs leaves SYFT_MEMORY_PER_JOB MiB for another job. A single job is always
+admitted, so the stage makes progress on small hosts.
+
+SYFT_MANIFEST lists the image ID, the layers and the SBOM file of every
+image. With SYFT_INCREMENTAL=True the SBOM of the previous run is reused for
+images with the same image ID or the same layers, if the SBOM file is still
+unchanged. The name, the namespace and the root package of a reused SBOM are
+rewritten if it was generated for another image reference or image ID.
+
+If SYFT_STORE is set, all SBOMs are additionally written to a compact SBOM
+store at this path, see sbom_store and query-sbom-store.py.
+
+Exit codes:
+    0: All SBOMs were generated
+    1: At least one syft run failed
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
 import subprocess
+import sys
+import threading
+import time
+import uuid
+from functools import partial
+from typing import Dict, List, Optional
 
+from docker import DockerClient
+from docker.errors import ImageNotFound
 from loguru import logger
+from tabulate import tabulate
 from yaml import safe_load, YAMLError
 
+import docker_stage
+import sbom_store
+
+SYFT = os.environ.get("SYFT", "/usr/local/bin/syft")
+SYFT_PARALLEL_JOBS = int(os.environ.get("SYFT_PARALLEL_JOBS", "4"))
+SYFT_MEMORY_PER_JOB = int(os.environ.get("SYFT_MEMORY_PER_JOB", "2048"))
+SYFT_TIMEOUT = int(os.environ.get("SYFT_TIMEOUT", "1800"))
+SYFT_MANIFEST = os.environ.get("SYFT_MANIFEST", "sbom-manifest.json")
+SYFT_INCREMENTAL = os.environ.get("SYFT_INCREMENTAL", "False")
+SYFT_STORE = os.environ.get("SYFT_STORE", None)
+
+# Configure logger
+logger.remove()
+log_fmt = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | "
+    "<level>{message}</level>"
+)
+logger.add(sys.stderr, format=log_fmt)
+
+
+def available_memory() -> Optional[int]:
+    """
+    Available memory of the host in MiB, or None if it is unknown.
+    """
+    try:
+        with open("/proc/meminfo") as fp:
+            for line in fp:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    return None
+
+
+class MemoryGate:
+    """
+    Admission of jobs by the available memory of the host.
+
+    Every admitted job reserves memory_per_job MiB until it is released. The
+    available memory is read again whenever a job waits for admission, a job
+    that just started has not yet allocated its memory, therefore the
+    reservations of all running jobs are subtracted.
+    """
+
+    def __init__(self, memory_per_job: int, interval: float = 5.0):
+        self.memory_per_job = memory_per_job
+        self.interval = interval
+        self.running = 0
+        self.condition = threading.Condition()
+
+    def _admissible(self) -> bool:
+        if self.running == 0:
+            return True
+
+        available = available_memory()
+        if available is None:
+            return True
+
+        return available - self.running * self.memory_per_job >= self.memory_per_job
+
+    def acquire(self) -> float:
+        """
+        Wait for admission.
+
+        Returns:
+            Seconds waited
+        """
+        start = time.monotonic()
+        with self.condition:
+            while not self._admissible():
+                self.condition.wait(self.interval)
+            self.running += 1
+
+        return time.monotonic() - start
+
+    def release(self) -> None:
+        with self.condition:
+            self.running -= 1
+            self.condition.notify_all()
+
+
+def run_syft(args, stdout, gate: MemoryGate, result: Dict) -> Optional[str]:
+    """
+    Run syft once admitted by the memory gate.
+
+    The waiting time and the runtime are recorded in result.
+
+    Returns:
+        None on success, otherwise the reason of the failure
+    """
+    result["wait"] += gate.acquire()
+    start = time.monotonic()
+    try:
+        p = subprocess.run(
+            [SYFT, *args],
+            stdout=stdout,
+            stderr=subprocess.PIPE,
+            text=True,
+            timeout=SYFT_TIMEOUT,
+        )
+        if p.returncode != 0:
+            logger.error(f"syft {' '.join(args)} failed: {p.stderr.strip()}")
+            return f"exit code {p.returncode}"
+    except subprocess.TimeoutExpired:
+        return f"timeout after {SYFT_TIMEOUT}s"
+    except OSError as e:
+        return str(e)
+    finally:
+        gate.release()
+        result["runtime"] += time.monotonic() - start
+
+    return None
+
+
+def write_sbom(path: str, args, gate: MemoryGate, result: Dict) -> None:
+    """
+    Write the output of syft to path, the file is removed again if syft
+    fails, a stale or partial SBOM is never left behind.
+    """
+    with open(path, "w") as fp:
+        error = run_syft(args, fp, gate, result)
+
+    if error:
+        result["status"] = error
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def new_result(image: str) -> Dict:
+    return {"image": image, "status": "ok", "wait": 0.0, "runtime": 0.0}
+
+
+def sbom_file(image: str) -> str:
+    return image.split("/")[-1].split(":")[0] + ".spdx"
+
+
+def file_digest(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as fp:
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+                digest.update(chunk)
+            return "sha256:" + digest.hexdigest()
+    except OSError:
+        return None
+
+
+def load_manifest(path: str) -> List[Dict]:
+    try:
+        with open(path) as fp:
+            return json.load(fp)["images"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return []
+
+
+def find_reusable(
+    manifest: List[Dict], image_id: str, diff_ids: List[str], path: str
+) -> Optional[Dict]:
+    """
+    Find the entry of a previous run with the SBOM of an image.
+
+    Entries of the same image ID are preferred over entries with the same
+    layers, an entry is only used if its SBOM file was not modified.
+    """
+    candidates = sorted(
+        (
+            entry
+            for entry in manifest
+            if entry.get("id") == image_id or entry.get("layers") == diff_ids
+        ),
+        key=lambda entry: (entry.get("id") != image_id, entry.get("file") != path),
+    )
+    for entry in candidates:
+        if file_digest(entry["file"]) == entry.get("sha256"):
+            return entry
+
+    return None
+
+
+def _rewrite(value: str, replacements: Dict[str, str]) -> str:
+    # NOTE: All replacements are applied in a single pass, a replaced value
+    #       is never replaced again.
+    pattern = "|".join(
+        re.escape(old) for old in sorted(replacements, key=len, reverse=True)
+    )
+    return re.sub(pattern, lambda match: replacements[match.group(0)], value)
+
+
+def reuse_sbom(entry: Dict, image: str, image_id: str, path: str) -> None:
+    """
+    Reuse the SBOM of a previous run for an image.
+
+    If the SBOM was generated for another image reference or image ID, the
+    fields describing the image are rewritten: the document name, the
+    document namespace and the root packages of the document (name, version
+    and package URLs).
+
+    Raises:
+        OSError, ValueError: The SBOM could not be read or written
+    """
+    if entry["image"] == image and entry["id"] == image_id:
+        if entry["file"] != path:
+            shutil.copyfile(entry["file"], path)
+        return
+
+    with open(entry["file"]) as fp:
+        document = json.load(fp)
+
+    old_name, _, old_tag = entry["image"].rpartition(":")
+    name, _, tag = image.rpartition(":")
+    replacements = {entry["image"]: image}
+    if old_name and name:
+        replacements[old_name] = name
+    for old, new in [(entry["id"], image_id), (old_tag, tag)]:
+        if old and old != new:
+            if old.startswith("sha256:"):
+                replacements[old] = new
+                replacements[old.replace(":", "%3A")] = new.replace(":", "%3A")
+                replacements[old[7:]] = new[7:]
+            else:
+                # NOTE: Tags are too short to be replaced anywhere in a value,
+                #       only purl qualifiers are rewritten.
+                replacements[f"tag={old}"] = f"tag={new}"
+
+    document["name"] = _rewrite(document.get("name", ""), replacements)
+
+    # NOTE: The namespace of every SPDX document has to be unique.
+    namespace = _rewrite(document.get("documentNamespace", ""), replacements)
+    namespace = re.sub(r"-[0-9a-f]{8}(-[0-9a-f]{4}){3}-[0-9a-f]{12}$", "", namespace)
+    document["documentNamespace"] = f"{namespace}-{uuid.uuid4()}"
+
+    for package in document.get("packages", []):
+        if "DocumentRoot" not in package.get("SPDXID", ""):
+            continue
+        package["name"] = _rewrite(package.get("name", ""), replacements)
+        version = package.get("versionInfo", "")
+        package["versionInfo"] = (
+            tag if version == old_tag else _rewrite(version, replacements)
+        )
+        for ref in package.get("externalRefs", []):
+            ref["referenceLocator"] = _rewrite(
+                ref.get("referenceLocator", ""), replacements
+            )
+
+    with open(f"{path}.tmp", "w") as fp:
+        json.dump(document, fp, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def get_image(client, image: str):
+    """
+    Get a local image, or None if it does not exist.
+    """
+    try:
+        return client.images.get(image)
+    except ImageNotFound:
+        logger.error(f"Image {image} not found")
+        return None
+
+
+def generate_sbom(gate: MemoryGate, image: str) -> Dict:
+    """
+    Run syft for an image and write <name>.spdx.
+
+    Returns:
+        Dictionary with image, status, wait and runtime of the run
+    """
+    path = sbom_file(image)
+    result = new_result(image)
+
+    logger.info(f"Generating SBOM for {image} as {path}")
+    write_sbom(path, ["packages", image, "-o", "spdx-json"], gate, result)
+    return result
+
+
 with open("images.yml", "r") as fp:
     try:
-        images = safe_load(fp)
+        sbom = safe_load(fp)
     except YAMLError as e:
         logger.error(e)
+        sys.exit(1)
+
+images = [item["image"] for item in (sbom or {}).get("images", []) or []]
+logger.info(
+    f"Generating {len(images)} SBOMs, {SYFT_PARALLEL_JOBS} parallel jobs, "
+    f"{SYFT_MEMORY_PER_JOB} MiB per job, {available_memory()} MiB available"
+)
+
+gate = MemoryGate(SYFT_MEMORY_PER_JOB)
+limit = max(1, SYFT_PARALLEL_JOBS)
+start = time.monotonic()
 
-processes = []
-for image in images:
-    name = image.split("/")[-1].split(":")[0]
-    logger.info(f"Generating SBOM for {image} as {name}.spdx")
-    p = subprocess.Popen(
-        f"/usr/local/bin/syft packages {image} -o spdx-json > {name}.spdx", shell=True
+client = DockerClient(max_pool_size=limit)
+image_objects = {}
+results = {}
+for image, obj in zip(
+    images,
+    docker_stage.gather([partial(get_image, client, image) for image in images], limit),
+):
+    if obj is None:
+        results[image] = {**new_result(image), "status": "image not found"}
+    else:
+        image_objects[image] = obj
+layers = {obj.id: obj.attrs["RootFS"]["Layers"] for obj in image_objects.values()}
+
+previous = load_manifest(SYFT_MANIFEST) if SYFT_INCREMENTAL == "True" else []
+for image, obj in image_objects.items():
+    path = sbom_file(image)
+    entry = find_reusable(previous, obj.id, layers[obj.id], path)
+    if entry is None:
+        continue
+
+    try:
+        reuse_sbom(entry, image, obj.id, path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Reusing the SBOM of {entry['image']} failed: {e}")
+        continue
+    logger.info(f"Reusing SBOM of {entry['image']} for {image}")
+    results[image] = {**new_result(image), "status": "reused"}
+
+pending = [image for image in images if image not in results]
+reused = [image for image in images if results.get(image, {}).get("status") == "reused"]
+logger.info(f"Reusing {len(reused)} SBOMs, generating {len(pending)} SBOMs")
+
+calls = [partial(generate_sbom, gate, image) for image in pending]
+for result in docker_stage.gather(calls, limit):
+    results[result["image"]] = result
+
+duration = time.monotonic() - start
+
+print(
+    tabulate(
+        [
+            [r["image"], r["status"], f"{r['wait']:.1f}", f"{r['runtime']:.1f}"]
+            for r in sorted(results.values(), key=lambda r: r["runtime"], reverse=True)
+        ],
+        headers=["image", "status", "wait (s)", "runtime (s)"],
+        tablefmt="psql",
     )
-    processes.append(p)
+)
+
+manifest = [
+    {
+        "id": image_objects[image].id,
+        "image": image,
+        "file": sbom_file(image),
+        "sha256": file_digest(sbom_file(image)),
+        "layers": layers[image_objects[image].id],
+    }
+    for image in images
+    if results[image]["status"] in ["ok", "reused"]
+]
+with open(f"{SYFT_MANIFEST}.tmp", "w") as fp:
+    json.dump({"images": manifest}, fp, indent=2)
+os.replace(f"{SYFT_MANIFEST}.tmp", SYFT_MANIFEST)
+
+if SYFT_STORE:
+    # NOTE: The documents are added one at a time, only one SBOM is held in
+    #       memory while writing the store.
+    with sbom_store.StoreWriter(SYFT_STORE) as store:
+        for entry in manifest:
+            with open(entry["file"]) as fp:
+                store.add(entry["image"], json.load(fp))
+    logger.info(f"Wrote {len(manifest)} SBOMs to {SYFT_STORE}")
+
+failed = [image for image in images if results[image]["status"] not in ["ok", "reused"]]
+logger.info(
+    f"Generated {len(images) - len(reused) - len(failed)} SBOMs and reused "
+    f"{len(reused)} SBOMs in {duration:.1f}s"
+)
 
-for p in processes:
-    p.wait()
+if failed:
+    logger.error(f"No SBOM was generated for {len(failed)} images:")
+    for image in failed:
+        logger.error(f"  {image}")
+    sys.exit(1)
@@ -0,0 +1,292 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Generators of the files derived from the release metadata.
+
+Every generator takes the release metadata as returned by
+release_metadata.load and returns the content of the generated file. The
+scripts generate-kolla-build-config.py, generate-apt-preferences-files.py,
+generate-template-overrides-file.py and get-projects-from-versions-file.py
+print the result of a single generator, generate-all.py runs several
+generators in one process.
+"""
+
+import datetime
+import os
+import re
+from typing import Dict, List
+
+import hiyapyco
+import jinja2
+from mako.template import Template
+
+import release_metadata
+
+BUILD_TYPE = os.environ.get("BUILD_TYPE", "all")
+HASH_DOCKER_IMAGES_KOLLA = os.environ.get("HASH_DOCKER_IMAGES_KOLLA", "none")
+HASH_KOLLA = os.environ.get("HASH_KOLLA", "none")
+HASH_RELEASE = os.environ.get("HASH_RELEASE", "none")
+IS_RELEASE = os.environ.get("IS_RELEASE", "False")
+KOLLA_BASE = os.environ.get("BASE", "ubuntu")
+KOLLA_BASE_TAG = os.environ.get("BASE_VERSION", "22.04")
+KOLLA_INSTALL_TYPE = "source"
+KOLLA_NAMESPACE = os.environ.get("DOCKER_NAMESPACE", "osism")
+KOLLA_VERSION = os.environ.get("KOLLA_VERSION", "none")
+OPENSTACK_VERSION = os.environ.get("OPENSTACK_VERSION", "latest")
+VERSION = os.environ.get("VERSION", "latest")
+
+OPENSTACK_CORE_PROJECTS = [
+    "cinder",
+    "designate",
+    "glance",
+    "horizon",
+    "keystone",
+    "neutron",
+    "nova",
+    "octavia",
+    "placement",
+]
+
+
+def _jinja2_template(name: str) -> jinja2.Template:
+    loader = jinja2.FileSystemLoader(searchpath="templates/%s" % OPENSTACK_VERSION)
+    environment = jinja2.Environment(loader=loader)
+    return environment.get_template(name)
+
+
+def kolla_build_config(versions: Dict) -> str:
+    """
+    Render kolla-build.conf from templates/<version>/kolla-build.conf.j2.
+    """
+    projects = []
+    for project in versions["openstack_projects"].keys():
+        if project in ["gnocchi", "novajoin"]:
+            continue
+
+        repository = project
+
+        if project == "neutron-lbaas-agent":
+            repository = "neutron-lbaas"
+
+        elif project == "neutron-vpnaas-agent":
+            repository = "neutron-vpnaas"
+
+        # NOTE: use stable branches for monasca for the moment
+        elif project == "monasca":
+            continue
+
+        projects.append(
+            {
+                "name": project,
+                "version": versions["openstack_projects"][project],
+                "repository": repository,
+            }
+        )
+
+    projects_with_version = [
+        x for x in projects if versions["openstack_projects"][x["name"]]
+    ]
+
+    template_data = {
+        "base": KOLLA_BASE,
+        "base_tag": KOLLA_BASE_TAG,
+        "gnocchi_version": versions["openstack_projects"].get("gnocchi", ""),
+        "install_type": KOLLA_INSTALL_TYPE,
+        "is_release": IS_RELEASE,
+        "namespace": KOLLA_NAMESPACE,
+        "openstack_release": versions["openstack_version"],
+        "projects": projects_with_version,
+        "versions": versions,
+    }
+
+    if "novajoin" in versions["openstack_projects"]:
+        novajoin_version = versions["openstack_projects"]["novajoin"]
+        template_data["novajoin_version"] = novajoin_version
+
+    return _jinja2_template("kolla-build.conf.j2").render(template_data)
+
+
+def apt_preferences(versions: Dict) -> str:
+    """
+    Render apt_preferences.ubuntu from templates/<version>/apt_preferences.ubuntu.j2.
+    """
+    template_data = {"infrastructure_projects": versions["infrastructure_projects"]}
+    return _jinja2_template("apt_preferences.ubuntu.j2").render(template_data)
+
+
+def template_overrides(versions: Dict) -> str:
+    """
+    Render template-overrides.j2 from templates/<version>/template-overrides.mako.
+    """
+    filename = "templates/%s/template-overrides.mako" % OPENSTACK_VERSION
+    template = Template(filename=filename)
+    data = {
+        "base": KOLLA_BASE,
+        "base_tag": KOLLA_BASE_TAG,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "hash_docker_images_kolla": HASH_DOCKER_IMAGES_KOLLA,
+        "hash_kolla": HASH_KOLLA,
+        "hash_release": HASH_RELEASE,
+        "infrastructure_projects": versions["infrastructure_projects"],
+        "kolla_version": KOLLA_VERSION,
+        "openstack_version": OPENSTACK_VERSION,
+        "version": VERSION,
+    }
+    return template.render(**data)
+
+
+def projects(versions: Dict) -> str:
+    """
+    Build the kolla-build regular expressions of the projects of BUILD_TYPE.
+
+    Raises:
+        ValueError: BUILD_TYPE is not supported
+    """
+    result = []
+
+    # NOTE: The release metadata is shared, the project lists are copied
+    #       before they are modified.
+    if BUILD_TYPE in ["all", "base"]:
+        all_projects = versions["openstack_projects"].copy()
+        all_projects.update(versions["infrastructure_projects"])
+
+    elif BUILD_TYPE == "openstack-core":
+        all_projects = [
+            x for x in versions["openstack_projects"] if x in OPENSTACK_CORE_PROJECTS
+        ]
+
+    elif BUILD_TYPE == "openstack-additional":
+        all_projects = [
+            x
+            for x in versions["openstack_projects"]
+            if x not in OPENSTACK_CORE_PROJECTS
+        ]
+
+    elif BUILD_TYPE == "infrastructure":
+        all_projects = versions["infrastructure_projects"].copy()
+        del all_projects["openstack-base"]
+
+    else:
+        raise ValueError("BUILD_TYPE %s not supported" % BUILD_TYPE)
+
+    next_projects_filter = []
+    if IS_RELEASE == "True":
+        next_filename = f"release/next/kolla-{VERSION}.yml"
+        if os.path.exists(next_filename):
+            next_overwrites = release_metadata.load_file(next_filename)
+            if "openstack_projects_filter" in next_overwrites:
+                next_projects_filter = next_overwrites["openstack_projects_filter"]
+
+    # NOTE: The projects are matched against the filter of the versions file,
+    #       extended by the filter of the next release. A filter of the next
+    #       release without one in the versions file raises KeyError.
+    openstack_projects_filter = []
+    if versions.get("openstack_projects_filter") or next_projects_filter:
+        openstack_projects_filter = (
+            versions["openstack_projects_filter"] + next_projects_filter
+        )
+
+    # This allows us to only rebuild some images for minor releases and
+    # not to rebuild all images.
+    for project in all_projects:
+        if (
+            "vpnaas" not in project
+            and "lbaas" not in project
+            and "dynamic-routing" not in project
+            and (not openstack_projects_filter or project in openstack_projects_filter)
+        ):
+            result.append(project)
+
+    return "^" + " ^".join(sorted(result))
+
+
+def merge_repos(overlay: str, destination: str) -> None:
+    """
+    Merge the repos.yaml overlay into the repos.yaml of kolla.
+    """
+    repos = hiyapyco.load(destination, overlay, method=hiyapyco.METHOD_MERGE)
+    with open(destination, "w+") as fp:
+        fp.write(hiyapyco.dump(repos, default_flow_style=False))
+
+
+def _match_option(option: str, line: str):
+    # NOTE: Commented out options are matched as well, like ini_file does.
+    return re.match(
+        r"( |\t)*([#;]?)( |\t)*(%s)( |\t)*(=|$)( |\t)*(.*)" % re.escape(option), line
+    )
+
+
+def set_option(lines: List[str], section: str, option: str, value: str) -> List[str]:
+    """
+    Set an option of an INI file the way the ini_file module of Ansible does
+    with its defaults (state=present, exclusive=true).
+
+    An existing, possibly commented out, line of the option is replaced and
+    further lines of the option are removed. A new option is added after the
+    last line of the section that is neither blank nor a comment, a new
+    section is added at the end of the file.
+
+    Args:
+        lines: Lines of the file, including the line breaks
+
+    Returns:
+        Lines of the modified file
+    """
+    lines = list(lines) or ["\n"]
+    if not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+
+    # NOTE: A leading pseudo section holds the lines before the first section,
+    #       a trailing one simplifies finding the end of the last section.
+    lines = ["[]"] + lines + ["["]
+    assignment = "%s = %s\n" % (option, value)
+
+    pattern = re.compile(r"^\[\s*%s\s*]" % re.escape(section.strip()))
+    within_section = False
+    start = end = 0
+    for index, line in enumerate(lines):
+        if within_section and line.startswith("["):
+            end = index
+            break
+        if pattern.match(line):
+            within_section = True
+            start = index
+
+    section_lines = lines[start:end]
+    changed = [False] * len(section_lines)
+    pending = True
+
+    for index, line in enumerate(section_lines):
+        match = _match_option(option, line)
+        if match and match.group(8) == value:
+            section_lines[index] = assignment
+            changed[index] = True
+            pending = False
+            break
+
+    if pending:
+        for index, line in enumerate(section_lines):
+            if not changed[index] and _match_option(option, line):
+                section_lines[index] = assignment
+                changed[index] = True
+                pending = False
+                break
+
+    for index in range(len(section_lines) - 1, 0, -1):
+        if not changed[index] and _match_option(option, section_lines[index]):
+            del section_lines[index]
+            del changed[index]
+
+    if pending:
+        for index in range(len(section_lines), 0, -1):
+            if not re.match(r"^[ \t]*([#;].*)?$", section_lines[index - 1]):
+                section_lines.insert(index, assignment)
+                break
+
+    lines = (lines[:start] + section_lines + lines[end:])[1:-1]
+
+    if not within_section:
+        lines.append("[%s]\n" % section)
+        lines.append(assignment)
+
+    return lines
@@ -0,0 +1,165 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Change labels of local images by rewriting their image config.
+
+Adding a label does not touch the filesystem of an image, only its config
+JSON. Instead of running a build with a `FROM` and `LABEL` instruction, a new
+config is derived from the inspect data of the image and loaded through the
+image import API of the Docker daemon together with a docker save style
+manifest. The layers are not part of the archive, the daemon reuses the
+layers it already has.
+
+Several images can be relabelled with one archive and one API call.
+"""
+
+import hashlib
+import io
+import json
+import tarfile
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+
+def _history(client, image_id: str, diff_ids: List[str]) -> Optional[List[Dict]]:
+    """
+    Reconstruct the history of an image config from the history API.
+
+    The API does not return the empty_layer flag, it is derived from the
+    size of the history entries. If that does not add up to the number of
+    layers, e.g. because a build step created an empty layer, the history
+    is ambiguous and None is returned.
+    """
+    history = []
+    for entry in reversed(client.api.history(image_id)):
+        item = {
+            "created": datetime.fromtimestamp(entry["Created"], timezone.utc)
+            .isoformat()
+            .replace("+00:00", "Z"),
+            "created_by": entry.get("CreatedBy", ""),
+        }
+        if entry.get("Comment"):
+            item["comment"] = entry["Comment"]
+        if entry.get("Size", 0) == 0:
+            item["empty_layer"] = True
+        history.append(item)
+
+    if len([item for item in history if not item.get("empty_layer")]) != len(diff_ids):
+        return None
+
+    return history
+
+
+def build_config(client, image, labels: Dict[str, str]) -> bytes:
+    """
+    Build the config JSON of an image with additional labels.
+
+    Args:
+        client: Docker client
+        image: Docker image to derive the config from
+        labels: Labels to add or replace
+
+    Returns:
+        Serialised image config
+    """
+    attrs = image.attrs
+    diff_ids = attrs["RootFS"]["Layers"]
+
+    container_config = dict(attrs["Config"] or {})
+    container_config["Labels"] = {**(container_config.get("Labels") or {}), **labels}
+
+    config = {
+        "architecture": attrs["Architecture"],
+        "os": attrs["Os"],
+        "created": attrs["Created"],
+        "config": container_config,
+        "rootfs": {"type": "layers", "diff_ids": diff_ids},
+    }
+
+    for key, name in [("Variant", "variant"), ("Author", "author")]:
+        if attrs.get(key):
+            config[name] = attrs[key]
+
+    history = _history(client, image.id, diff_ids)
+    if history is None:
+        logger.info(f"History of {image.id} is ambiguous and not preserved")
+    else:
+        label_string = " ".join(f"{key}={value}" for key, value in labels.items())
+        history.append(
+            {
+                "created": datetime.now(timezone.utc)
+                .isoformat()
+                .replace("+00:00", "Z"),
+                "created_by": f"LABEL {label_string}",
+                "empty_layer": True,
+            }
+        )
+        config["history"] = history
+
+    return json.dumps(config, separators=(",", ":")).encode()
+
+
+def relabel_images(client, relabels: List[Dict]) -> Dict[str, str]:
+    """
+    Add labels to images with a single call of the image import API.
+
+    Args:
+        client: Docker client
+        relabels: List of dictionaries with the keys
+            - image: Docker image to relabel
+            - labels: Labels to add
+            - tags: Tags of the relabelled image, existing tags are moved
+
+    Returns:
+        Mapping of the old image IDs to the new image IDs
+    """
+    manifest = []
+    new_ids = {}
+
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        for relabel in relabels:
+            image = relabel["image"]
+            config = build_config(client, image, relabel["labels"])
+            digest = hashlib.sha256(config).hexdigest()
+
+            info = tarfile.TarInfo(f"{digest}.json")
+            info.size = len(config)
+            tar.addfile(info, io.BytesIO(config))
+
+            # NOTE: The layer paths do not exist in the archive. The daemon only
+            #       reads a layer if its chain is not yet in the layer store, which
+            #       is never the case for a local image.
+            manifest.append(
+                {
+                    "Config": f"{digest}.json",
+                    "RepoTags": relabel["tags"],
+                    "Layers": [
+                        f"{diff_id.split(':')[1]}/layer.tar"
+                        for diff_id in image.attrs["RootFS"]["Layers"]
+                    ],
+                }
+            )
+            new_ids[image.id] = f"sha256:{digest}"
+
+        data = json.dumps(manifest).encode()
+        info = tarfile.TarInfo("manifest.json")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+    logger.info(f"Loading new configs of {len(relabels)} images")
+    client.images.load(archive.getvalue())
+
+    # The relabelled images share all layers with the old ones, removing the
+    # old images only removes their configs.
+    for old_id, new_id in new_ids.items():
+        if old_id == new_id:
+            continue
+        try:
+            client.images.remove(old_id)
+        except Exception as e:
+            logger.debug(f"Old image {old_id} not removed: {e}")
+
+    return new_ids
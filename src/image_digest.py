@@ -0,0 +1,121 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Compute the manifest digests of local images without skopeo.
+
+For an image in the Docker daemon, skopeo inspect reports the digest of a
+Docker schema 2 manifest it derives from the docker save archive of the
+image: the config blob and one descriptor per layer with the DiffID and the
+size of the uncompressed layer tarball. The same manifest is rebuilt here,
+for all images with a single docker save. Only the sizes of the members of
+the archive are needed, no layer is parsed.
+"""
+
+import hashlib
+import json
+import posixpath
+import subprocess
+import tarfile
+from typing import Dict, List
+
+from loguru import logger
+
+from image_metadata import config_id
+
+CONFIG_MEDIA_TYPE = "application/vnd.docker.container.image.v1+json"
+MANIFEST_MEDIA_TYPE = "application/vnd.docker.distribution.manifest.v2+json"
+
+# NOTE: skopeo uses the media type of compressed layers for the uncompressed
+#       layers of docker save archives as well.
+LAYER_MEDIA_TYPE = "application/vnd.docker.image.rootfs.diff.tar.gzip"
+
+
+def build_manifest(config_digest: str, config_size: int, layers: List) -> bytes:
+    """
+    Serialise a schema 2 manifest the way skopeo does.
+
+    Args:
+        config_digest: Digest of the image config, i.e. the image ID
+        config_size: Size of the image config in bytes
+        layers: Tuples of DiffID and size of the uncompressed layer tarball
+
+    Returns:
+        Compact JSON of the manifest
+    """
+    manifest = {
+        "schemaVersion": 2,
+        "mediaType": MANIFEST_MEDIA_TYPE,
+        "config": {
+            "mediaType": CONFIG_MEDIA_TYPE,
+            "size": config_size,
+            "digest": config_digest,
+        },
+        "layers": [
+            {"mediaType": LAYER_MEDIA_TYPE, "size": size, "digest": diff_id}
+            for diff_id, size in layers
+        ],
+    }
+    return json.dumps(manifest, separators=(",", ":")).encode()
+
+
+def compute_digests(client, names: List[str]) -> Dict[str, str]:
+    """
+    Compute the manifest digests of local images as reported by skopeo.
+
+    Args:
+        client: Docker client
+        names: References of the images in the Docker daemon
+
+    Returns:
+        Mapping of the image references to their manifest digests, images
+        missing in the archive are left out
+    """
+    images = {}
+    for name in names:
+        image = client.images.get(name)
+        images[name] = (image.id, image.attrs["RootFS"]["Layers"])
+
+    sizes = {}
+    links = {}
+    manifest = []
+
+    image_ids = sorted({image_id for image_id, _ in images.values()})
+    logger.info(f"Exporting {len(image_ids)} images with docker save")
+
+    process = subprocess.Popen(["docker", "save", *image_ids], stdout=subprocess.PIPE)
+    try:
+        with tarfile.open(fileobj=process.stdout, mode="r|") as archive:
+            for member in archive:
+                if member.issym():
+                    links[member.name] = posixpath.normpath(
+                        posixpath.join(posixpath.dirname(member.name), member.linkname)
+                    )
+                elif member.name == "manifest.json":
+                    manifest = json.load(archive.extractfile(member))
+                elif member.isfile():
+                    sizes[member.name] = member.size
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+
+    if returncode != 0:
+        raise RuntimeError(f"docker save failed with exit code {returncode}")
+
+    manifests = {}
+    for entry in manifest:
+        image_id = config_id(entry["Config"])
+        config_path = links.get(entry["Config"], entry["Config"])
+        layer_sizes = [sizes[links.get(path, path)] for path in entry["Layers"]]
+        manifests[image_id] = (sizes[config_path], layer_sizes)
+
+    digests = {}
+    for name, (image_id, diff_ids) in images.items():
+        if image_id not in manifests:
+            logger.warning(f"{name} is missing in the docker save archive")
+            continue
+
+        config_size, layer_sizes = manifests[image_id]
+        data = build_manifest(image_id, config_size, list(zip(diff_ids, layer_sizes)))
+        digests[name] = "sha256:" + hashlib.sha256(data).hexdigest()
+
+    return digests
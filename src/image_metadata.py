@@ -0,0 +1,365 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Read package metadata straight from the layers of local container images.
+
+The layers are streamed out of the Docker daemon with a single `docker save`
+call. For every layer the dpkg status database and the metadata of the
+installed Python distributions are parsed, afterwards the layers of each image
+are merged in order, honouring the whiteout files of the overlay filesystem.
+No container is started for this.
+
+The per-layer indexes are cached by layer DiffID. Most Kolla images share the
+base and openstack-base layers, so these are parsed only once.
+"""
+
+import json
+import os
+import posixpath
+import re
+import subprocess
+import tarfile
+from typing import Dict, Iterable, List, Optional
+
+from loguru import logger
+
+DPKG_STATUS = "var/lib/dpkg/status"
+
+# NOTE: pip3 inside the Kolla images is the one of the virtual environment,
+#       distributions installed there take precedence over system packages.
+PYTHON_PREFERRED_PREFIX = "var/lib/kolla/venv/"
+
+PYTHON_METADATA = re.compile(
+    r"^(?P<dist>.*/(?:site|dist)-packages/[^/]+\.(?:dist-info|egg-info))"
+    r"/(?:METADATA|PKG-INFO)$"
+)
+
+WHITEOUT_PREFIX = ".wh."
+WHITEOUT_OPAQUE = ".wh..wh..opq"
+
+
+def normalise_distribution_name(name: str) -> str:
+    """
+    Normalise a Python distribution name as described in PEP 503.
+
+    Example: "Openstack_Placement" -> "openstack-placement"
+    """
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def parse_dpkg_status(text: str) -> Dict[str, str]:
+    """
+    Parse the dpkg status database.
+
+    Args:
+        text: Content of /var/lib/dpkg/status
+
+    Returns:
+        Mapping of installed package names to their versions
+    """
+    packages = {}
+    for paragraph in text.split("\n\n"):
+        fields = {}
+        for line in paragraph.splitlines():
+            if not line or line[0] in " \t" or ":" not in line:
+                continue
+            key, value = line.split(":", 1)
+            fields[key] = value.strip()
+
+        if "Package" not in fields or "Version" not in fields:
+            continue
+        if not fields.get("Status", "").endswith(" installed"):
+            continue
+
+        packages[fields["Package"]] = fields["Version"]
+
+    return packages
+
+
+def parse_python_metadata(text: str) -> Optional[Dict[str, str]]:
+    """
+    Parse the header of a METADATA or PKG-INFO file.
+
+    Args:
+        text: Content of the metadata file
+
+    Returns:
+        Dictionary with name and version, or None if one of them is missing
+    """
+    fields = {}
+    for line in text.splitlines():
+        # the header ends with the first empty line, the description follows
+        if not line:
+            break
+        if ":" not in line:
+            continue
+        key, value = line.split(":", 1)
+        if key in ("Name", "Version") and key not in fields:
+            fields[key] = value.strip()
+
+    if "Name" not in fields or "Version" not in fields:
+        return None
+
+    return {"name": fields["Name"], "version": fields["Version"]}
+
+
+def index_layer(fileobj) -> Dict:
+    """
+    Collect the package metadata contained in a single layer tarball.
+
+    Args:
+        fileobj: Stream of the uncompressed layer tarball
+
+    Returns:
+        Dictionary with the keys
+        - dpkg: package versions, None if the layer has no dpkg status file
+        - python: distribution directory -> name and version
+        - whiteouts: paths removed by this layer
+        - opaque: directories whose content of lower layers is hidden
+    """
+    index = {"dpkg": None, "python": {}, "whiteouts": [], "opaque": []}
+
+    with tarfile.open(fileobj=fileobj, mode="r|") as tar:
+        for member in tar:
+            path = posixpath.normpath(member.name.lstrip("/"))
+            directory, basename = posixpath.split(path)
+
+            if basename == WHITEOUT_OPAQUE:
+                index["opaque"].append(directory)
+                continue
+
+            if basename.startswith(WHITEOUT_PREFIX):
+                index["whiteouts"].append(
+                    posixpath.join(directory, basename[len(WHITEOUT_PREFIX) :])
+                )
+                continue
+
+            if not member.isfile():
+                continue
+
+            if path == DPKG_STATUS:
+                text = tar.extractfile(member).read().decode("utf-8", "replace")
+                index["dpkg"] = parse_dpkg_status(text)
+                continue
+
+            match = PYTHON_METADATA.match(path)
+            if match:
+                text = tar.extractfile(member).read().decode("utf-8", "replace")
+                metadata = parse_python_metadata(text)
+                if metadata:
+                    index["python"][match.group("dist")] = metadata
+
+    return index
+
+
+def _is_removed(path: str, removed: str) -> bool:
+    return path == removed or path.startswith(removed + "/")
+
+
+def merge_layer_indexes(layers: Iterable[Dict]) -> Dict[str, Dict[str, str]]:
+    """
+    Merge the indexes of the layers of an image, lowest layer first.
+
+    Args:
+        layers: Layer indexes as returned by index_layer
+
+    Returns:
+        Dictionary with the keys dpkg (package -> version) and
+        python (normalised distribution name -> version)
+    """
+    dpkg = {}
+    python = {}
+
+    for layer in layers:
+        for removed in layer["whiteouts"] + layer["opaque"]:
+            if _is_removed(DPKG_STATUS, removed):
+                dpkg = {}
+            python = {
+                path: metadata
+                for path, metadata in python.items()
+                if not _is_removed(path, removed)
+            }
+
+        # the status file always contains the complete database
+        if layer["dpkg"] is not None:
+            dpkg = layer["dpkg"]
+
+        python.update(layer["python"])
+
+    versions = {}
+    for path in sorted(
+        python, key=lambda x: (x.startswith(PYTHON_PREFERRED_PREFIX), x), reverse=True
+    ):
+        name = normalise_distribution_name(python[path]["name"])
+        versions.setdefault(name, python[path]["version"])
+
+    return {"dpkg": dpkg, "python": versions}
+
+
+class LayerIndexCache:
+    """
+    Content-addressed cache of layer indexes, keyed by the layer DiffID.
+
+    The indexes are always kept in memory for the current run. If a directory
+    is given, they are additionally stored there as one JSON file per layer
+    and reused by later runs.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self.indexes = {}
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, diff_id: str) -> str:
+        return os.path.join(self.directory, diff_id.replace(":", "-") + ".json")
+
+    def get(self, diff_id: str) -> Optional[Dict]:
+        if diff_id in self.indexes:
+            return self.indexes[diff_id]
+
+        if self.directory and os.path.exists(self._path(diff_id)):
+            try:
+                with open(self._path(diff_id)) as fp:
+                    self.indexes[diff_id] = json.load(fp)
+                return self.indexes[diff_id]
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring broken layer index of {diff_id}: {e}")
+
+        return None
+
+    def put(self, diff_id: str, index: Dict) -> None:
+        self.indexes[diff_id] = index
+
+        if self.directory:
+            path = self._path(diff_id)
+            with open(f"{path}.tmp", "w") as fp:
+                json.dump(index, fp)
+            os.replace(f"{path}.tmp", path)
+
+
+def config_id(config_path: str) -> str:
+    """
+    Derive the image ID from the config path of a docker save manifest.
+
+    Example: "blobs/sha256/abc..." or "abc....json" -> "sha256:abc..."
+    """
+    return "sha256:" + posixpath.basename(config_path).split(".")[0]
+
+
+def _save_layers(images: Dict[str, List[str]], cache: LayerIndexCache) -> None:
+    """
+    Index the layers of images with a single docker save.
+
+    Layers shared between the images are contained only once in the archive.
+    Blobs of the OCI layout are named after their DiffID, these are skipped
+    without parsing if they are already in the cache.
+
+    Args:
+        images: Mapping of the IDs of the images to export to their DiffIDs
+        cache: Cache the new layer indexes are added to
+    """
+    layers = {}
+    links = {}
+    manifest = []
+
+    process = subprocess.Popen(
+        ["docker", "save", *images.keys()], stdout=subprocess.PIPE
+    )
+    try:
+        with tarfile.open(fileobj=process.stdout, mode="r|") as archive:
+            for member in archive:
+                if member.issym():
+                    links[member.name] = posixpath.normpath(
+                        posixpath.join(posixpath.dirname(member.name), member.linkname)
+                    )
+                    continue
+
+                if not member.isfile():
+                    continue
+
+                if member.name == "manifest.json":
+                    manifest = json.load(archive.extractfile(member))
+                    continue
+
+                if member.name.startswith("blobs/sha256/"):
+                    digest = "sha256:" + posixpath.basename(member.name)
+                    if cache.get(digest) is not None:
+                        continue
+                elif not member.name.endswith("/layer.tar"):
+                    continue
+
+                # NOTE: In the OCI layout every blob is stored below blobs/, the
+                #       image configs and manifests are no tarballs and skipped.
+                try:
+                    layers[member.name] = index_layer(archive.extractfile(member))
+                except tarfile.ReadError:
+                    continue
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+
+    if returncode != 0:
+        raise RuntimeError(f"docker save failed with exit code {returncode}")
+
+    for entry in manifest:
+        diff_ids = images.get(config_id(entry["Config"]), [])
+        for path, diff_id in zip(entry["Layers"], diff_ids):
+            path = links.get(path, path)
+            if path in layers:
+                cache.put(diff_id, layers[path])
+
+
+def index_images(
+    images: Dict[str, List[str]], cache: Optional[LayerIndexCache] = None
+) -> Dict[str, Dict[str, Dict[str, str]]]:
+    """
+    Read the package metadata of several images from their layers.
+
+    Each layer is parsed at most once: the per-layer indexes are kept in a
+    content-addressed cache and merged for every image. Only images with at
+    least one layer missing in the cache are exported, all of them with a
+    single docker save.
+
+    Args:
+        images: Mapping of image IDs to their layer DiffIDs (RootFS.Layers)
+        cache: Layer index cache, a new in-memory cache is used if omitted
+
+    Returns:
+        Mapping of image IDs to their merged package metadata
+    """
+    if cache is None:
+        cache = LayerIndexCache()
+
+    # NOTE: Select the images to export greedily, an image whose missing
+    #       layers are all contained in an already selected image (e.g. a
+    #       *-base image of a service image) does not have to be exported.
+    missing = {}
+    covered = set()
+    for image_id, diff_ids in sorted(
+        images.items(), key=lambda item: len(item[1]), reverse=True
+    ):
+        uncached = {diff_id for diff_id in diff_ids if cache.get(diff_id) is None}
+        if uncached - covered:
+            missing[image_id] = diff_ids
+            covered.update(uncached)
+
+    unique_layers = {diff_id for diff_ids in images.values() for diff_id in diff_ids}
+    logger.info(
+        f"Reading package metadata of {len(images)} images with "
+        f"{len(unique_layers)} unique layers, exporting {len(missing)} images"
+    )
+
+    if missing:
+        _save_layers(missing, cache)
+
+    result = {}
+    for image_id, diff_ids in images.items():
+        layers = [cache.get(diff_id) for diff_id in diff_ids]
+        if any(layer is None for layer in layers):
+            logger.warning(f"Not all layers of {image_id} could be read")
+            continue
+        result[image_id] = merge_layer_indexes(layers)
+
+    return result
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Index all published SBOM images in a local SQLite database.
+
+The sync command lists all tags of the SBOM repositories, resolves every tag
+to its manifest digest with a HEAD request and fetches images.yml only for
+digests that are not yet indexed. Tags that were moved or deleted are
+updated, so after the first sync only new SBOMs are transferred.
+
+Queries:
+    releases NAME VERSION   releases that shipped the component or image
+                            NAME in version VERSION
+    first NAME VERSION      first release (by creation date) that shipped
+                            NAME in version VERSION, or in VERSION or later
+                            with --or-later
+    show TAG                images and versions of a release
+
+NAME is a key of the versions of the SBOM (e.g. ovn) or an image name (e.g.
+nova-api), VERSION is compared without the date postfix of the image tags.
+
+Exit codes:
+    0: Success
+    1: Query without result
+    2: Fatal errors (registry errors, database errors, etc.)
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import os
+import sqlite3
+import sys
+import tarfile
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from loguru import logger
+from packaging.version import InvalidVersion, Version
+from requests.exceptions import RequestException
+from tabulate import tabulate
+from yaml import safe_load, YAMLError
+
+import registry
+from sbom_diff import extract_image_name, strip_date_postfix
+
+# Configure logger
+logger.remove()
+log_fmt = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | "
+    "<level>{message}</level>"
+)
+logger.add(sys.stderr, format=log_fmt)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sboms (
+    digest TEXT PRIMARY KEY,
+    openstack_version TEXT,
+    created TEXT,
+    indexed TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tags (
+    repository TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    digest TEXT NOT NULL REFERENCES sboms (digest),
+    PRIMARY KEY (repository, tag)
+);
+CREATE TABLE IF NOT EXISTS images (
+    digest TEXT NOT NULL REFERENCES sboms (digest),
+    name TEXT NOT NULL,
+    image TEXT NOT NULL,
+    version TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS versions (
+    digest TEXT NOT NULL REFERENCES sboms (digest),
+    component TEXT NOT NULL,
+    version TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_name ON images (name, version);
+CREATE INDEX IF NOT EXISTS versions_component ON versions (component, version);
+CREATE INDEX IF NOT EXISTS tags_digest ON tags (digest);
+"""
+
+# Releases shipping NAME in VERSION, NAME is a component or an image name
+RELEASES_QUERY = """
+SELECT tags.repository, tags.tag, sboms.openstack_version, sboms.created, matches.version
+FROM (
+    SELECT digest, version FROM versions WHERE component = :name
+    UNION
+    SELECT digest, version FROM images WHERE name = :name
+) AS matches
+JOIN sboms ON sboms.digest = matches.digest
+JOIN tags ON tags.digest = matches.digest
+ORDER BY sboms.created, tags.repository, tags.tag
+"""
+
+
+def open_database(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def fetch_sbom(client: registry.RegistryClient, image_ref: str) -> Optional[Dict]:
+    """
+    Fetch and parse images.yml of an SBOM image.
+
+    Returns:
+        Parsed SBOM, or None if the image has no valid images.yml
+    """
+    data = client.read_file(image_ref, "/images.yml")
+    if data is None:
+        logger.warning(f"No images.yml in {image_ref}")
+        return None
+
+    try:
+        sbom = safe_load(data.decode("utf-8"))
+    except YAMLError as e:
+        logger.warning(f"Invalid images.yml in {image_ref}: {e}")
+        return None
+
+    if not isinstance(sbom, dict):
+        logger.warning(f"Invalid SBOM format in {image_ref}: expected dict")
+        return None
+
+    return sbom
+
+
+def _guarded(call, image_ref: str):
+    """
+    Run a registry call for a single image reference.
+
+    Returns:
+        Tuple of the result and None, or None and the error of the call
+    """
+    try:
+        return call(image_ref), None
+    except (registry.RegistryError, RequestException, tarfile.TarError) as e:
+        return None, e
+
+
+def store_sbom(connection: sqlite3.Connection, digest: str, sbom: Dict) -> None:
+    created = sbom.get("created")
+    if isinstance(created, datetime):
+        created = created.isoformat()
+
+    # NOTE: YAML parses unquoted OpenStack versions like 2025.1 as floats.
+    openstack_version = sbom.get("openstack_version")
+    if openstack_version is not None:
+        openstack_version = str(openstack_version)
+
+    connection.execute(
+        "INSERT OR REPLACE INTO sboms VALUES (?, ?, ?, ?)",
+        (
+            digest,
+            openstack_version,
+            created,
+            datetime.now(timezone.utc).isoformat(),
+        ),
+    )
+    connection.execute("DELETE FROM images WHERE digest = ?", (digest,))
+    connection.execute("DELETE FROM versions WHERE digest = ?", (digest,))
+
+    connection.executemany(
+        "INSERT INTO images VALUES (?, ?, ?, ?)",
+        [
+            (
+                digest,
+                extract_image_name(item["image"]),
+                item["image"],
+                strip_date_postfix(item["image"].split(":")[-1]),
+            )
+            for item in sbom.get("images", []) or []
+            if isinstance(item, dict) and "image" in item
+        ],
+    )
+    connection.executemany(
+        "INSERT INTO versions VALUES (?, ?, ?)",
+        [
+            (digest, component, strip_date_postfix(str(version)))
+            for component, version in (sbom.get("versions", {}) or {}).items()
+        ],
+    )
+
+
+def sync(connection: sqlite3.Connection, repositories: List[str], jobs: int) -> None:
+    """
+    Bring the index up to date with the tags of the SBOM repositories.
+
+    Args:
+        connection: Index database
+        repositories: Repositories of the SBOM images, without tag
+        jobs: Number of concurrent registry requests
+    """
+    client = registry.RegistryClient()
+
+    for repository in repositories:
+        tags = client.list_tags(repository)
+        logger.info(f"Found {len(tags)} tags in {repository}")
+
+        # NOTE: Tags that can not be resolved or fetched are skipped, their
+        #       rows of the index are kept until a later sync succeeds.
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            resolved = list(
+                executor.map(
+                    partial(_guarded, client.head_manifest),
+                    [f"{repository}:{tag}" for tag in tags],
+                )
+            )
+        current = {}
+        failed = set()
+        for tag, (digest, error) in zip(tags, resolved):
+            if error is not None:
+                logger.warning(f"Resolving {repository}:{tag} failed: {error}")
+                failed.add(tag)
+            else:
+                current[tag] = digest
+
+        known = dict(
+            connection.execute(
+                "SELECT tag, digest FROM tags WHERE repository = ?", (repository,)
+            )
+        )
+        indexed = {row[0] for row in connection.execute("SELECT digest FROM sboms")}
+
+        missing = sorted(set(current.values()) - indexed)
+        logger.info(
+            f"{len(set(current.values()))} unique SBOMs in {repository}, "
+            f"{len(missing)} not yet indexed"
+        )
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            sboms = list(
+                executor.map(
+                    partial(_guarded, partial(fetch_sbom, client)),
+                    [registry.with_digest(repository, digest) for digest in missing],
+                )
+            )
+
+        with connection:
+            for digest, (sbom, error) in zip(missing, sboms):
+                if error is not None:
+                    logger.warning(
+                        f"Fetching the SBOM of {repository}@{digest} failed: {error}"
+                    )
+                    failed.update(tag for tag, d in current.items() if d == digest)
+                elif sbom is not None:
+                    store_sbom(connection, digest, sbom)
+                    indexed.add(digest)
+
+            # tags of images without a valid SBOM are not indexed
+            current = {tag: d for tag, d in current.items() if d in indexed}
+
+            for tag, digest in current.items():
+                if known.get(tag) != digest:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO tags VALUES (?, ?, ?)",
+                        (repository, tag, digest),
+                    )
+
+            for tag in set(known) - set(current) - failed:
+                logger.info(f"Removing tag {repository}:{tag} from the index")
+                connection.execute(
+                    "DELETE FROM tags WHERE repository = ? AND tag = ?",
+                    (repository, tag),
+                )
+
+            # SBOMs without any tag left are removed from the index
+            for table in ["images", "versions", "sboms"]:
+                connection.execute(
+                    f"DELETE FROM {table} WHERE digest NOT IN (SELECT digest FROM tags)"
+                )
+
+
+def matches_version(version: str, wanted: str, or_later: bool) -> bool:
+    if not or_later:
+        return version == wanted
+
+    try:
+        return Version(version) >= Version(wanted)
+    except InvalidVersion:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Index all published SBOM images in a local SQLite database",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Exit codes:
+  0 - Success
+  1 - Query without result
+  2 - Fatal errors (registry errors, database errors, etc.)
+""",
+    )
+    parser.add_argument(
+        "--database",
+        type=str,
+        default=os.environ.get("SBOM_INDEX_DATABASE", "sbom-index.sqlite3"),
+        help="Path of the index database "
+        "(default: sbom-index.sqlite3, env: SBOM_INDEX_DATABASE)",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_sync = subparsers.add_parser("sync", help="Update the index")
+    parser_sync.add_argument(
+        "--repository",
+        "-r",
+        action="append",
+        default=None,
+        help="Repository of SBOM images, can be repeated "
+        "(default: registry.osism.cloud/kolla/sbom)",
+    )
+    parser_sync.add_argument(
+        "--parallel-jobs",
+        "-j",
+        type=int,
+        default=8,
+        help="Number of concurrent registry requests (default: 8)",
+    )
+
+    parser_releases = subparsers.add_parser(
+        "releases", help="Releases that shipped NAME in VERSION"
+    )
+    parser_releases.add_argument("name")
+    parser_releases.add_argument("version")
+
+    parser_first = subparsers.add_parser(
+        "first", help="First release that shipped NAME in VERSION"
+    )
+    parser_first.add_argument("name")
+    parser_first.add_argument("version")
+    parser_first.add_argument(
+        "--or-later",
+        action="store_true",
+        default=False,
+        help="Find the first release with VERSION or a later version",
+    )
+
+    parser_show = subparsers.add_parser("show", help="Contents of a release")
+    parser_show.add_argument("tag")
+
+    args = parser.parse_args()
+
+    try:
+        connection = open_database(args.database)
+    except sqlite3.Error as e:
+        logger.error(f"Failed to open {args.database}: {e}")
+        sys.exit(2)
+
+    if args.command == "sync":
+        repositories = args.repository or ["registry.osism.cloud/kolla/sbom"]
+        try:
+            sync(connection, repositories, args.parallel_jobs)
+        except (registry.RegistryError, sqlite3.Error, OSError) as e:
+            logger.error(f"Sync failed: {e}")
+            sys.exit(2)
+        logger.success("Index is up to date")
+        sys.exit(0)
+
+    if args.command in ["releases", "first"]:
+        wanted = strip_date_postfix(args.version)
+        or_later = args.command == "first" and args.or_later
+        rows = [
+            row
+            for row in connection.execute(RELEASES_QUERY, {"name": args.name})
+            if matches_version(row[4], wanted, or_later)
+        ]
+        if args.command == "first":
+            rows = rows[:1]
+
+    else:
+        rows = list(
+            connection.execute(
+                """
+                SELECT 'image', images.name, images.version FROM tags
+                JOIN images ON images.digest = tags.digest WHERE tags.tag = :tag
+                UNION ALL
+                SELECT 'version', versions.component, versions.version FROM tags
+                JOIN versions ON versions.digest = tags.digest WHERE tags.tag = :tag
+                ORDER BY 1, 2
+                """,
+                {"tag": args.tag},
+            )
+        )
+
+    if not rows:
+        logger.warning("No matching releases found")
+        sys.exit(1)
+
+    headers = (
+        ["kind", "name", "version"]
+        if args.command == "show"
+        else ["repository", "tag", "openstack_version", "created", "version"]
+    )
+    print(tabulate(rows, headers=headers, tablefmt="psql"))
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Query an SBOM store written by generate-sbom-with-syft.py (SYFT_STORE).
+
+Queries:
+    images                  images in the store and their number of packages
+    versions NAME           versions of the package NAME in all images
+    show IMAGE              packages of an image
+    export IMAGE            SPDX document of an image
+
+images, versions and show only read the index of the store, export
+decompresses the document of a single image.
+
+Exit codes:
+    0: Success
+    1: Query without result
+    2: Fatal errors (missing or broken store, etc.)
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from loguru import logger
+from tabulate import tabulate
+
+import sbom_store
+
+# Configure logger
+logger.remove()
+log_fmt = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | "
+    "<level>{message}</level>"
+)
+logger.add(sys.stderr, format=log_fmt)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Query an SBOM store",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Exit codes:
+  0 - Success
+  1 - Query without result
+  2 - Fatal errors (missing or broken store, etc.)
+""",
+    )
+    parser.add_argument(
+        "--store",
+        type=str,
+        default=os.environ.get("SYFT_STORE", "sboms.store"),
+        help="Path of the SBOM store (default: sboms.store, env: SYFT_STORE)",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("images", help="Images in the store")
+
+    parser_versions = subparsers.add_parser(
+        "versions", help="Versions of a package in all images"
+    )
+    parser_versions.add_argument("name")
+    parser_versions.add_argument(
+        "--type",
+        type=str,
+        default=None,
+        help="Only packages of this purl type, e.g. deb or pypi",
+    )
+
+    parser_show = subparsers.add_parser("show", help="Packages of an image")
+    parser_show.add_argument("image")
+
+    parser_export = subparsers.add_parser("export", help="SPDX document of an image")
+    parser_export.add_argument("image")
+    parser_export.add_argument(
+        "--output",
+        "-o",
+        type=str,
+        default=None,
+        help="Write the document to this file instead of stdout",
+    )
+
+    args = parser.parse_args()
+
+    try:
+        store = sbom_store.StoreReader(args.store)
+    except (OSError, sbom_store.StoreError) as e:
+        logger.error(f"Failed to open {args.store}: {e}")
+        sys.exit(2)
+
+    with store:
+        if args.command == "export":
+            document = store.read(args.image)
+            if document is None:
+                logger.warning(f"{args.image} is not in the store")
+                sys.exit(1)
+
+            if args.output:
+                with open(args.output, "w") as fp:
+                    json.dump(document, fp, indent=2)
+            else:
+                json.dump(document, sys.stdout, indent=2)
+                print()
+            sys.exit(0)
+
+        if args.command == "images":
+            headers = ["image", "packages"]
+            rows = [
+                [image, len(store.index[image]["packages"])] for image in store.images()
+            ]
+        elif args.command == "versions":
+            headers = ["image", "name", "version", "type"]
+            rows = list(store.packages(args.name, args.type))
+        else:
+            headers = ["name", "version", "type"]
+            rows = sorted(
+                store.index.get(args.image, {}).get("packages", []),
+                key=lambda package: (package[2], package[0]),
+            )
+
+    if not rows:
+        logger.warning("No matching entries found")
+        sys.exit(1)
+
+    print(tabulate(rows, headers=headers, tablefmt="psql", disable_numparse=True))
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,451 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Minimal client for the Docker Registry HTTP API V2.
+
+Reads manifests and blobs of images straight from a registry, without a
+Docker daemon. Supports anonymous and token authentication, credentials from
+the Docker configuration (~/.docker/config.json, including credential
+helpers), Docker and OCI manifests as well as manifest lists and image
+indexes. Registries on localhost are accessed via plain HTTP.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import posixpath
+import re
+import subprocess
+import tarfile
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+DOCKER_HUB = "registry-1.docker.io"
+
+MANIFEST_TYPES = [
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+]
+
+INDEX_TYPES = [
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+]
+
+
+class RegistryError(Exception):
+    pass
+
+
+class NotFoundError(RegistryError):
+    pass
+
+
+def parse_reference(image_ref: str) -> Tuple[str, str, str]:
+    """
+    Split an image reference into registry, repository and tag or digest.
+
+    Example: "registry.osism.cloud/kolla/sbom:2025.1"
+             -> ("registry.osism.cloud", "kolla/sbom", "2025.1")
+    """
+    name, reference = image_ref, "latest"
+    if "@" in name:
+        name, reference = name.split("@", 1)
+    elif ":" in name.split("/")[-1]:
+        name, reference = name.rsplit(":", 1)
+
+    parts = name.split("/")
+    if len(parts) > 1 and (
+        "." in parts[0] or ":" in parts[0] or parts[0] == "localhost"
+    ):
+        registry, repository = parts[0], "/".join(parts[1:])
+    else:
+        registry, repository = "docker.io", name
+
+    if registry in ("docker.io", "index.docker.io"):
+        registry = DOCKER_HUB
+        if "/" not in repository:
+            repository = f"library/{repository}"
+
+    return registry, repository, reference
+
+
+def with_digest(image_ref: str, digest: str) -> str:
+    """
+    Pin an image reference to a digest.
+
+    Example: "quay.io/osism/sbom:2025.1", "sha256:abc..." -> "quay.io/osism/sbom@sha256:abc..."
+    """
+    registry, repository, _ = parse_reference(image_ref)
+    return f"{registry}/{repository}@{digest}"
+
+
+def _docker_config() -> Dict:
+    config_dir = os.environ.get("DOCKER_CONFIG", os.path.expanduser("~/.docker"))
+    try:
+        with open(os.path.join(config_dir, "config.json")) as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+
+def get_credentials(registry: str) -> Optional[Tuple[str, str]]:
+    """
+    Look up the credentials of a registry in the Docker configuration.
+
+    Returns:
+        Tuple of username and password, or None for anonymous access
+    """
+    config = _docker_config()
+    names = [registry]
+    if registry == DOCKER_HUB:
+        names = ["https://index.docker.io/v1/", "index.docker.io", "docker.io"]
+
+    helper = None
+    for name in names:
+        helper = config.get("credHelpers", {}).get(name)
+        if helper:
+            break
+    helper = helper or config.get("credsStore")
+
+    for name in names:
+        if helper:
+            try:
+                result = subprocess.run(
+                    [f"docker-credential-{helper}", "get"],
+                    input=name,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                )
+                data = json.loads(result.stdout)
+                return data["Username"], data["Secret"]
+            except (OSError, ValueError, KeyError, subprocess.CalledProcessError):
+                pass
+
+        auth = config.get("auths", {}).get(name, {}).get("auth")
+        if auth:
+            username, password = base64.b64decode(auth).decode().split(":", 1)
+            return username, password
+
+    return None
+
+
+class RegistryClient:
+    """
+    Client for the registries of image references.
+
+    Tokens are cached per registry and repository for the lifetime of the
+    client, the HTTP connections are reused. pool_size is the number of
+    connections kept per registry, it should not be lower than the number of
+    threads sharing the client.
+    """
+
+    def __init__(self, timeout: int = 30, pool_size: int = 10):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.timeout = timeout
+        self.tokens = {}
+
+    def _url(self, registry: str, path: str) -> str:
+        host = registry.split(":")[0]
+        scheme = "http" if host in ("localhost", "127.0.0.1", "::1") else "https"
+        return f"{scheme}://{registry}/v2/{path}"
+
+    def _authenticate(self, registry: str, repository: str, challenge: str) -> None:
+        credentials = get_credentials(registry)
+
+        if challenge.lower().startswith("basic"):
+            if not credentials:
+                raise RegistryError(f"{registry} requires credentials")
+            self.tokens[(registry, repository)] = ("Basic", credentials)
+            return
+
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        realm = params.pop("realm", None)
+        if not realm:
+            raise RegistryError(f"Unsupported authentication challenge: {challenge}")
+        params.setdefault("scope", f"repository:{repository}:pull")
+        logger.debug(f"Requesting a token for {repository} from {realm}")
+
+        response = self.session.get(
+            realm, params=params, auth=credentials, timeout=self.timeout
+        )
+        if response.status_code != 200:
+            raise RegistryError(
+                f"Authentication at {realm} failed with status {response.status_code}"
+            )
+        data = response.json()
+        self.tokens[(registry, repository)] = (
+            "Bearer",
+            data.get("token") or data.get("access_token"),
+        )
+
+    def request(
+        self,
+        method: str,
+        registry: str,
+        repository: str,
+        path: str,
+        headers: Optional[Dict] = None,
+        stream: bool = False,
+    ) -> requests.Response:
+        """
+        Send a request to the registry, authenticating if asked to.
+
+        Raises:
+            NotFoundError: The manifest or blob does not exist
+            RegistryError: Any other error status
+        """
+        url = self._url(registry, f"{repository}/{path}")
+
+        for attempt in range(2):
+            request_headers = dict(headers or {})
+            auth = None
+            kind, token = self.tokens.get((registry, repository), (None, None))
+            if kind == "Bearer":
+                request_headers["Authorization"] = f"Bearer {token}"
+            elif kind == "Basic":
+                auth = token
+
+            response = self.session.request(
+                method,
+                url,
+                headers=request_headers,
+                auth=auth,
+                stream=stream,
+                timeout=self.timeout,
+            )
+
+            # NOTE: Tokens expire after a few minutes, a cached token rejected
+            #       during a long run is replaced once from the new challenge.
+            if response.status_code == 401 and attempt == 0:
+                challenge = response.headers.get("WWW-Authenticate", "")
+                response.close()
+                self.tokens.pop((registry, repository), None)
+                self._authenticate(registry, repository, challenge)
+                continue
+            break
+
+        if response.status_code == 404:
+            response.close()
+            raise NotFoundError(f"{url} not found")
+        if response.status_code >= 400:
+            response.close()
+            raise RegistryError(
+                f"{method} {url} failed with status {response.status_code}"
+            )
+
+        return response
+
+    def list_tags(self, repository_ref: str, page_size: int = 1000) -> List[str]:
+        """
+        List all tags of a repository, following the pagination of the
+        registry.
+
+        Args:
+            repository_ref: Repository without tag, e.g. "registry.osism.cloud/kolla/sbom"
+            page_size: Number of tags requested per page
+
+        Returns:
+            Tags of the repository
+        """
+        registry, repository, _ = parse_reference(repository_ref)
+
+        tags = []
+        path = f"tags/list?n={page_size}"
+        while path:
+            response = self.request("GET", registry, repository, path)
+            tags.extend(response.json().get("tags") or [])
+
+            # Link: </v2/<repository>/tags/list?last=...&n=...>; rel="next"
+            match = re.search(
+                r'<([^>]+)>;\s*rel="?next"?', response.headers.get("Link", "")
+            )
+            path = None
+            if match:
+                path = match.group(1).split(f"/v2/{repository}/", 1)[-1]
+
+        return tags
+
+    def head_manifest(self, image_ref: str) -> str:
+        """
+        Resolve an image reference to the digest of its manifest with a HEAD
+        request, without downloading the manifest.
+
+        Returns:
+            Digest of the manifest, or of the manifest list for multi-platform
+            images
+        """
+        registry, repository, reference = parse_reference(image_ref)
+        headers = {"Accept": ", ".join(MANIFEST_TYPES)}
+
+        response = self.request(
+            "HEAD", registry, repository, f"manifests/{reference}", headers
+        )
+        digest = response.headers.get("Docker-Content-Digest")
+        if not digest:
+            raise RegistryError(f"No digest returned for {image_ref}")
+
+        return digest
+
+    def get_manifest(
+        self, image_ref: str, platform: str = "linux/amd64"
+    ) -> Tuple[Dict, str]:
+        """
+        Fetch the image manifest of an image reference.
+
+        Manifest lists and image indexes are resolved to the manifest of the
+        given platform, or the first manifest if the platform is not found.
+
+        Returns:
+            Tuple of the manifest and its digest
+        """
+        manifest, digest, _ = self.resolve_manifest(image_ref, platform)
+        return manifest, digest
+
+    def resolve_manifest(
+        self, image_ref: str, platform: str = "linux/amd64"
+    ) -> Tuple[Dict, str, str]:
+        """
+        Fetch the image manifest of an image reference like get_manifest.
+
+        Returns:
+            Tuple of the manifest, its digest and the digest the reference
+            points to, the digest of the manifest list for multi-platform
+            images
+        """
+        registry, repository, reference = parse_reference(image_ref)
+        headers = {"Accept": ", ".join(MANIFEST_TYPES)}
+
+        response = self.request(
+            "GET", registry, repository, f"manifests/{reference}", headers
+        )
+        manifest = response.json()
+        digest = response.headers.get(
+            "Docker-Content-Digest",
+            "sha256:" + hashlib.sha256(response.content).hexdigest(),
+        )
+        reference_digest = digest
+
+        media_type = manifest.get("mediaType") or response.headers.get(
+            "Content-Type", ""
+        )
+        if media_type in INDEX_TYPES or "manifests" in manifest:
+            os_name, architecture = platform.split("/")[:2]
+            entries = manifest.get("manifests", [])
+            selected = next(
+                (
+                    entry
+                    for entry in entries
+                    if entry.get("platform", {}).get("os") == os_name
+                    and entry.get("platform", {}).get("architecture") == architecture
+                ),
+                entries[0] if entries else None,
+            )
+            if selected is None:
+                raise NotFoundError(f"{image_ref} has an empty manifest list")
+
+            response = self.request(
+                "GET", registry, repository, f"manifests/{selected['digest']}", headers
+            )
+            manifest = response.json()
+            digest = selected["digest"]
+
+        return manifest, digest, reference_digest
+
+    def open_blob(self, image_ref: str, digest: str) -> requests.Response:
+        """
+        Open a blob of the repository of an image reference as a stream.
+        """
+        registry, repository, _ = parse_reference(image_ref)
+        return self.request("GET", registry, repository, f"blobs/{digest}", stream=True)
+
+    def read_file(self, image_ref: str, path: str) -> Optional[bytes]:
+        """
+        Read a single file from the filesystem of an image.
+
+        The layers are searched from the top. Each layer is streamed through
+        tarfile in memory and the download stops at the first layer that
+        contains or removes the file. A file is removed by a whiteout of the
+        file or of one of its parent directories, or by an opaque whiteout
+        (.wh..wh..opq) of one of its parent directories.
+
+        Args:
+            image_ref: Image reference
+            path: Absolute path of the file in the image
+
+        Returns:
+            Content of the file, or None if the image does not contain it
+        """
+        manifest, _ = self.get_manifest(image_ref)
+        path = posixpath.normpath(path.lstrip("/"))
+
+        whiteouts = set()
+        opaques = set()
+        current = path
+        while current:
+            directory, basename = posixpath.split(current)
+            whiteouts.add(posixpath.join(directory, f".wh.{basename}"))
+            if current != path:
+                opaques.add(posixpath.join(current, ".wh..wh..opq"))
+            current = directory
+
+        for layer in reversed(manifest.get("layers", [])):
+            if "zstd" in layer.get("mediaType", ""):
+                raise RegistryError(f"zstd compressed layer {layer['digest']}")
+
+            # NOTE: An opaque whiteout only hides the lower layers, the file
+            #       may still be part of the layer with the whiteout.
+            opaque = False
+            with self.open_blob(image_ref, layer["digest"]) as response:
+                reader = DigestReader(response.raw)
+                with tarfile.open(fileobj=reader, mode="r|*") as tar:
+                    for member in tar:
+                        name = posixpath.normpath(member.name.lstrip("/"))
+                        if name in whiteouts:
+                            return None
+                        if name in opaques:
+                            opaque = True
+                        if name == path and member.isfile():
+                            data = tar.extractfile(member).read()
+                            reader.verify(layer["digest"])
+                            return data
+
+            if opaque:
+                return None
+
+        return None
+
+
+class DigestReader:
+    """
+    File-like wrapper of a stream computing the digest of the read data.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hash = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self.hash.update(data)
+        return data
+
+    def digest(self) -> str:
+        # read the rest of the stream, e.g. the end of archive blocks
+        while self.read(65536):
+            pass
+        return f"sha256:{self.hash.hexdigest()}"
+
+    def verify(self, digest: str) -> None:
+        if self.digest() != digest:
+            raise RegistryError(f"Digest mismatch of blob {digest}")
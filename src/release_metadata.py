@@ -0,0 +1,82 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Loader of the release metadata (release/latest/openstack-<version>.yml).
+
+The file is parsed at most once per process, with the C implementation of
+the safe loader if PyYAML was built with libyaml. The parsed data is also
+stored as a pickle file named after the sha256 of the YAML file, later
+processes load the pickle instead of parsing the YAML file again.
+
+The returned data is shared, callers must not modify it.
+"""
+
+import hashlib
+import os
+import pickle
+from typing import Dict
+
+import yaml
+from loguru import logger
+
+RELEASE_METADATA_CACHE = os.environ.get(
+    "RELEASE_METADATA_CACHE", ".release-metadata-cache"
+)
+
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+_loaded = {}
+
+
+def release_file(openstack_version: str) -> str:
+    return "release/latest/openstack-%s.yml" % openstack_version
+
+
+def load_file(filename: str) -> Dict:
+    """
+    Load a YAML file of the release repository.
+
+    Args:
+        filename: Path of the YAML file
+
+    Returns:
+        Parsed content of the file
+    """
+    with open(filename, "rb") as fp:
+        data = fp.read()
+
+    digest = hashlib.sha256(data).hexdigest()
+    if digest in _loaded:
+        return _loaded[digest]
+
+    path = None
+    if RELEASE_METADATA_CACHE:
+        path = os.path.join(RELEASE_METADATA_CACHE, f"{digest}.pickle")
+        try:
+            with open(path, "rb") as fp:
+                _loaded[digest] = pickle.load(fp)
+            return _loaded[digest]
+        except FileNotFoundError:
+            pass
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logger.warning(f"Ignoring broken cache file {path}: {e}")
+
+    _loaded[digest] = yaml.load(data, Loader=Loader)
+
+    if path:
+        try:
+            os.makedirs(RELEASE_METADATA_CACHE, exist_ok=True)
+            with open(f"{path}.tmp", "wb") as fp:
+                pickle.dump(_loaded[digest], fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logger.warning(f"Failed to write cache file {path}: {e}")
+
+    return _loaded[digest]
+
+
+def load(openstack_version: str) -> Dict:
+    """
+    Load the release metadata of an OpenStack version.
+    """
+    return load_file(release_file(openstack_version))
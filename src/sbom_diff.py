@@ -0,0 +1,206 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Diff engine for a series of SBOMs (images.yml files).
+
+The SBOMs are compared in the given order, each one with its predecessor.
+All versions are parsed once into packaging Version objects, a version string
+that appears in several SBOMs is parsed only once. The result is a plain
+dictionary that can be written as JSON or YAML:
+
+    snapshots    names of the SBOMs in order
+    transitions  per pair of consecutive SBOMs the added and removed images,
+                 the added and removed components and the upgraded and
+                 downgraded components
+    components   per component the version in every SBOM (None if absent)
+                 and all of its downgrades
+    summary      number of transitions with changes and of downgrades
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from packaging.version import InvalidVersion, Version
+
+
+def strip_date_postfix(version_string: str) -> str:
+    """
+    Strip date postfix from version string.
+
+    Example: "20.0.0.20251020" -> "20.0.0"
+
+    Args:
+        version_string: Version string potentially with date postfix
+
+    Returns:
+        Version string without date postfix
+    """
+    parts = version_string.split(".")
+
+    # Find first part that looks like a date (8 digits starting with 20)
+    cleaned_parts = []
+    for part in parts:
+        if len(part) == 8 and part.startswith("20"):
+            # This looks like a date (YYYYMMDD), stop here
+            break
+        cleaned_parts.append(part)
+
+    return ".".join(cleaned_parts) if cleaned_parts else version_string
+
+
+def extract_image_name(image_path: str) -> str:
+    """
+    Extract service name from full image path.
+
+    Example: "osism.harbor.regio.digital/kolla/ovn-sb-db-relay:25.3.1.20251020"
+             -> "ovn-sb-db-relay"
+
+    Args:
+        image_path: Full image path with registry, repository and tag
+
+    Returns:
+        Service name (between last '/' and ':')
+    """
+    # Split by '/' to get the last part (image:tag)
+    image_with_tag = image_path.split("/")[-1]
+
+    # Split by ':' to get just the image name
+    image_name = image_with_tag.split(":")[0]
+
+    return image_name
+
+
+class Snapshot:
+    """
+    SBOM with pre-parsed image names and versions.
+    """
+
+    def __init__(self, name: str, sbom: Dict, parser: "VersionParser"):
+        self.name = name
+        self.images = {
+            extract_image_name(item["image"])
+            for item in sbom.get("images", []) or []
+            if isinstance(item, dict) and "image" in item
+        }
+        # component -> (version without date postfix, parsed version or None)
+        self.versions = {
+            component: parser.parse(str(version))
+            for component, version in (sbom.get("versions", {}) or {}).items()
+        }
+
+
+class VersionParser:
+    """
+    Memoising parser of SBOM versions.
+    """
+
+    def __init__(self):
+        self.parsed = {}
+
+    def parse(self, version_string: str) -> Tuple[str, Optional[Version]]:
+        clean = strip_date_postfix(version_string)
+        if clean not in self.parsed:
+            try:
+                self.parsed[clean] = Version(clean)
+            except InvalidVersion:
+                logger.warning(f"Invalid version {clean}")
+                self.parsed[clean] = None
+
+        return clean, self.parsed[clean]
+
+
+def diff_snapshots(old: Snapshot, new: Snapshot) -> Dict:
+    """
+    Compare two consecutive SBOMs.
+
+    Returns:
+        Dictionary with the image and version changes from old to new
+    """
+    upgraded = {}
+    downgraded = {}
+    for component in sorted(old.versions.keys() & new.versions.keys()):
+        old_clean, old_version = old.versions[component]
+        new_clean, new_version = new.versions[component]
+        if old_version is None or new_version is None or old_version == new_version:
+            continue
+
+        change = {"from": old_clean, "to": new_clean}
+        if new_version < old_version:
+            downgraded[component] = change
+        else:
+            upgraded[component] = change
+
+    return {
+        "from": old.name,
+        "to": new.name,
+        "images": {
+            "added": sorted(new.images - old.images),
+            "removed": sorted(old.images - new.images),
+        },
+        "versions": {
+            "added": {
+                component: new.versions[component][0]
+                for component in sorted(new.versions.keys() - old.versions.keys())
+            },
+            "removed": {
+                component: old.versions[component][0]
+                for component in sorted(old.versions.keys() - new.versions.keys())
+            },
+            "upgraded": upgraded,
+            "downgraded": downgraded,
+        },
+    }
+
+
+def diff_history(sboms: List[Tuple[str, Dict]]) -> Dict:
+    """
+    Compare a series of SBOMs, each one with its predecessor.
+
+    Args:
+        sboms: Names and contents of the SBOMs, oldest first
+
+    Returns:
+        Diff document as described in the module documentation
+    """
+    parser = VersionParser()
+    snapshots = [Snapshot(name, sbom, parser) for name, sbom in sboms]
+
+    transitions = [
+        diff_snapshots(old, new) for old, new in zip(snapshots, snapshots[1:])
+    ]
+
+    components = {}
+    for component in sorted({c for s in snapshots for c in s.versions}):
+        components[component] = {
+            "history": [
+                s.versions[component][0] if component in s.versions else None
+                for s in snapshots
+            ],
+            "downgrades": [],
+        }
+
+    for transition in transitions:
+        for component, change in transition["versions"]["downgraded"].items():
+            components[component]["downgrades"].append(
+                {
+                    "from_snapshot": transition["from"],
+                    "to_snapshot": transition["to"],
+                    **change,
+                }
+            )
+
+    return {
+        "snapshots": [s.name for s in snapshots],
+        "transitions": transitions,
+        "components": components,
+        "summary": {
+            "snapshots": len(snapshots),
+            "transitions_with_changes": sum(
+                1
+                for t in transitions
+                if any(t["images"].values()) or any(t["versions"].values())
+            ),
+            "downgrades": sum(len(t["versions"]["downgraded"]) for t in transitions),
+            "parsed_versions": len(parser.parsed),
+        },
+    }
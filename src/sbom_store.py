@@ -0,0 +1,209 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Compact store for the SPDX SBOMs of many images in a single file.
+
+Layout of the file:
+
+    MAGIC
+    one gzip member per image with the compact JSON of its SPDX document
+    one gzip member with the JSON index
+    footer: offset of the index (8 bytes, big endian) and MAGIC
+
+The index lists for every image the offset and length of its document and
+its packages as [name, version, type], type is the purl type (e.g. deb or
+pypi). Queries across all images only read the index, a single document is
+decompressed without touching the other members.
+
+The writer encodes and compresses every document incrementally. The reader
+decompresses only the member of the requested document, which is then parsed
+as a whole, so memory use is bounded by the largest single document.
+"""
+
+import gzip
+import io
+import json
+import os
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple
+
+MAGIC = b"SBOMSTORE1\n"
+FOOTER = struct.Struct(">Q")
+
+
+class StoreError(Exception):
+    pass
+
+
+def spdx_packages(document: Dict) -> List[List[str]]:
+    """
+    Extract name, version and purl type of the packages of an SPDX document.
+    """
+    packages = []
+    for package in document.get("packages", []):
+        purl_type = ""
+        for ref in package.get("externalRefs", []):
+            if ref.get("referenceType") == "purl":
+                # pkg:<type>/<namespace>/<name>@<version>
+                purl_type = ref.get("referenceLocator", "")[4:].split("/")[0]
+                break
+        packages.append(
+            [package.get("name", ""), package.get("versionInfo", ""), purl_type]
+        )
+
+    return packages
+
+
+class StoreWriter:
+    """
+    Write a store, documents are added one after the other.
+
+    Use as context manager, the index is written when leaving the context.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index = {}
+        self.fp = open(f"{path}.tmp", "wb")
+        self.fp.write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.fp.close()
+
+    def _write_member(self, document) -> Tuple[int, int]:
+        offset = self.fp.tell()
+        with gzip.GzipFile(fileobj=self.fp, mode="wb", mtime=0) as member:
+            writer = io.TextIOWrapper(member, encoding="utf-8")
+            for chunk in json.JSONEncoder(separators=(",", ":")).iterencode(document):
+                writer.write(chunk)
+            writer.flush()
+            writer.detach()
+
+        return offset, self.fp.tell() - offset
+
+    def add(self, image: str, document: Dict) -> None:
+        """
+        Add the SPDX document of an image, replacing an earlier document of
+        the same image in the index.
+        """
+        offset, length = self._write_member(document)
+        self.index[image] = {
+            "offset": offset,
+            "length": length,
+            "name": document.get("name", ""),
+            "packages": spdx_packages(document),
+        }
+
+    def close(self) -> None:
+        offset, _ = self._write_member({"images": self.index})
+        self.fp.write(FOOTER.pack(offset) + MAGIC)
+        self.fp.close()
+        os.replace(f"{self.path}.tmp", self.path)
+
+
+class _Slice(io.RawIOBase):
+    """
+    Read-only view of a byte range of a file.
+    """
+
+    def __init__(self, fp, offset: int, length: int):
+        self.fp = fp
+        self.fp.seek(offset)
+        self.remaining = length
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.fp.read(min(len(buffer), self.remaining))
+        self.remaining -= len(data)
+        buffer[: len(data)] = data
+        return len(data)
+
+
+class StoreReader:
+    """
+    Read a store written by StoreWriter.
+
+    Only the index is loaded when opening the store.
+    """
+
+    def __init__(self, path: str):
+        self.fp = open(path, "rb")
+        try:
+            if self.fp.read(len(MAGIC)) != MAGIC:
+                raise StoreError(f"{path} is not an SBOM store")
+
+            self.fp.seek(-(FOOTER.size + len(MAGIC)), io.SEEK_END)
+            end = self.fp.tell()
+            (offset,) = FOOTER.unpack(self.fp.read(FOOTER.size))
+            if self.fp.read() != MAGIC or offset >= end:
+                raise StoreError(f"{path} is truncated")
+
+            self.index = self._read_member(offset, end - offset)["images"]
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            self.fp.close()
+            raise StoreError(f"Failed to read the index of {path}: {e}")
+        except StoreError:
+            self.fp.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self) -> None:
+        self.fp.close()
+
+    def _read_member(self, offset: int, length: int):
+        with gzip.GzipFile(fileobj=_Slice(self.fp, offset, length)) as member:
+            return json.load(io.TextIOWrapper(member, encoding="utf-8"))
+
+    def images(self) -> List[str]:
+        return sorted(self.index)
+
+    def read(self, image: str) -> Optional[Dict]:
+        """
+        Read the SPDX document of an image, None if it is not in the store.
+        """
+        entry = self.index.get(image)
+        if entry is None:
+            return None
+
+        return self._read_member(entry["offset"], entry["length"])
+
+    def documents(self) -> Iterator[Tuple[str, Dict]]:
+        """
+        Iterate over the images and their documents, one document at a time.
+        """
+        for image in self.images():
+            yield image, self.read(image)
+
+    def packages(
+        self, name: Optional[str] = None, purl_type: Optional[str] = None
+    ) -> Iterator[Tuple[str, str, str, str]]:
+        """
+        Iterate over the packages of all images from the index.
+
+        Args:
+            name: Only packages with this name
+            purl_type: Only packages of this purl type
+
+        Returns:
+            Tuples of image, package name, version and purl type
+        """
+        for image in self.images():
+            for package_name, version, package_type in self.index[image]["packages"]:
+                if name is not None and package_name != name:
+                    continue
+                if purl_type is not None and package_type != purl_type:
+                    continue
+                yield image, package_name, version, package_type
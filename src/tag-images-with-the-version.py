@@ -1,20 +1,47 @@
 # SPDX-License-Identifier: Apache-2.0
 
+import argparse
+from contextlib import contextmanager
 from datetime import datetime, timezone
+from functools import partial
+import json
+import math
 import os
-from packaging import version as packaging_version
-from re import findall, sub
-import subprocess
+from re import sub
 import tempfile
+import threading
+import time
 
 from docker import DockerClient
+from docker.errors import APIError
 from tabulate import tabulate
 from loguru import logger
-from yaml import dump, safe_load, YAMLError
+from yaml import dump
+
+import docker_stage
+import image_config
+import image_metadata
+import version_extractors
+from image_metadata import normalise_distribution_name
 
 IS_RELEASE = os.environ.get("IS_RELEASE", "False")
 TAG_POSTFIX = os.environ.get("TAG_POSTFIX", None)
 OPENSTACK_VERSION = os.environ.get("OPENSTACK_VERSION", "zed")
+TAG_PARALLEL_JOBS = int(os.environ.get("TAG_PARALLEL_JOBS", "8"))
+TAG_PROBE_MODE = os.environ.get("TAG_PROBE_MODE", "container")
+TAG_LAYER_CACHE = os.environ.get("TAG_LAYER_CACHE", None)
+TAG_LABEL_MODE = os.environ.get("TAG_LABEL_MODE", "build")
+TAG_CACHE_FILE = os.environ.get("TAG_CACHE_FILE", ".tag-images-cache.json")
+TAG_CACHE_MAX_AGE = int(os.environ.get("TAG_CACHE_MAX_AGE", str(14 * 24 * 3600)))
+TAG_CACHE_MAX_ENTRIES = int(os.environ.get("TAG_CACHE_MAX_ENTRIES", "5000"))
+TAG_TIMINGS_FILE = os.environ.get("TAG_TIMINGS_FILE", None)
+DOCKER_NAMESPACE = os.environ.get("DOCKER_NAMESPACE", "osism")
+DOCKER_REGISTRY = os.environ.get("DOCKER_REGISTRY", "quay.io")
+KOLLA_TYPE = os.environ.get("KOLLA_TYPE", "")
+SOURCE_DOCKER_TAG = os.environ.get(
+    "SOURCE_DOCKER_TAG",
+    "build-%s" % os.environ.get("BUILD_ID", datetime.now().strftime("%Y%m%d")),
+)
 
 if IS_RELEASE == "True":
     VERSION = os.environ.get("VERSION", "zed")
@@ -23,343 +50,1016 @@ else:
     VERSION = OPENSTACK_VERSION
     FILTERS = {"label": f"de.osism.release.openstack={VERSION}"}
 
-with open("etc/tag-images-with-the-version.yml", "r") as fp:
-    try:
-        configuration = safe_load(fp)
-    except YAMLError as e:
-        logger.error(e)
+# NOTE: All built images carry the OpenStack label, the images of a release
+#       build are a subset of them.
+RETAG_FILTERS = {"label": f"de.osism.release.openstack={OPENSTACK_VERSION}"}
+
+SBOM_IMAGE_TO_VERSION = {
+    "aodh": "aodh-api",
+    "barbican": "barbican-api",
+    "bifrost": "bifrost-deploy",
+    "blazar": "blazar-api",
+    "ceilometer": "ceilometer-central",
+    "cinder": "cinder-api",
+    "cloudkitty": "cloudkitty-api",
+    "collectd": "collectd",
+    "cron": "cron",
+    "designate": "designate-api",
+    "dnsmasq": "dnsmasq",
+    "elasticsearch": "elasticsearch",
+    "elasticsearch_curator": "elasticsearch-curator",
+    "etcd": "etcd",
+    "fluentd": "fluentd",
+    "glance": "glance-api",
+    "gnocchi": "gnocchi-api",
+    "heat": "heat-api",
+    "grafana": "grafana",
+    "haproxy": "haproxy",
+    "haproxy_ssh": "haproxy-ssh",
+    "horizon": "horizon",
+    "influxdb": "influxdb",
+    "ironic": "ironic-api",
+    "ironic_inspector": "ironic-inspector",
+    "iscsid": "iscsid",
+    "kafka": "kafka",
+    "keepalived": "keepalived",
+    "keystone": "keystone",
+    "kibana": "kibana",
+    "kolla_toolbox": "kolla-toolbox",
+    "kolla-toolbox": "kolla-toolbox",
+    "kuryr": "kuryr-libnetwork",
+    "letsencrypt_lego": "letsencrypt-lego",
+    "letsencrypt_webserver": "letsencrypt-webserver",
+    "logstash": "logstash",
+    "magnum": "magnum-api",
+    "manila": "manila-api",
+    "mariadb": "mariadb-server",
+    "masakari": "masakari-api",
+    "memcached": "memcached",
+    "mistral": "mistral-api",
+    "multipathd": "multipathd",
+    "neutron": "neutron-server",
+    "nova": "nova-api",
+    "nova_libvirt": "nova-libvirt",
+    "octavia": "octavia-api",
+    "opensearch": "opensearch",
+    "opensearch_dashboards": "opensearch-dashboards",
+    "openvswitch": "openvswitch-vswitchd",
+    "ovn": "ovn-controller",
+    "hacluster": "hacluster",
+    "hacluster_corosync": "hacluster-corosync",
+    "placement": "placement-api",
+    "prometheus": "prometheus-server",
+    "prometheus_alertmanager": "prometheus-alertmanager",
+    "prometheus_blackbox_exporter": "prometheus-blackbox-exporter",
+    "prometheus_cadvisor": "prometheus-cadvisor",
+    "prometheus_elasticsearch_exporter": "prometheus-elasticsearch-exporter",
+    "prometheus_haproxy_exporter": "prometheus-haproxy-exporter",
+    "prometheus_libvirt_exporter": "prometheus-libvirt-exporter",
+    "prometheus_memcached_exporter": "prometheus-memcached-exporter",
+    "prometheus_msteams": "prometheus-msteams",
+    "prometheus_mtail": "prometheus-mtail",
+    "prometheus_mysqld_exporter": "prometheus-mysqld-exporter",
+    "prometheus_node_exporter": "prometheus-node-exporter",
+    "prometheus_openstack_exporter": "prometheus-openstack-exporter",
+    "prometheus_ovn_exporter": "prometheus-ovn-exporter",
+    "proxysql": "proxysql",
+    "rabbitmq": "rabbitmq",
+    "redis": "redis",
+    "senlin": "senlin-api",
+    "skyline": "skyline-apiserver",
+    "skyline_console": "skyline-console",
+    "storm": "storm",
+    "swift": "swift-object",
+    "tgtd": "tgtd",
+    "trove": "trove-api",
+    "valkey": "valkey-server",
+    "watcher": "watcher-api",
+}
+
+
+class ProbeCache:
+    """
+    On-disk cache of probe results, keyed by image ID.
+
+    An entry holds the extracted version, the build date and the best_key
+    used for the probe. Entries not used for TAG_CACHE_MAX_AGE seconds are
+    evicted, beyond TAG_CACHE_MAX_ENTRIES the least recently used entries
+    are evicted.
+    """
+
+    def __init__(self, path, enabled=True):
+        # NOTE: A disabled cache is not read, but still refreshed and saved.
+        self.path = path
+        self.enabled = enabled
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            try:
+                with open(path) as fp:
+                    self.entries = json.load(fp)
+                logger.info(f"Loaded {len(self.entries)} cached probe results")
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring broken probe cache {path}: {e}")
+
+    def get(self, image_id, best_key, build_date):
+        if not self.enabled:
+            return None
+
+        with self.lock:
+            entry = self.entries.get(image_id)
+            if (
+                not entry
+                or entry["best_key"] != best_key
+                or entry["build_date"] != build_date
+            ):
+                return None
+
+            entry["used"] = time.time()
+            return entry["version"]
+
+    def put(self, image_id, best_key, build_date, version):
+        with self.lock:
+            self.entries[image_id] = {
+                "best_key": best_key,
+                "build_date": build_date,
+                "version": version,
+                "used": time.time(),
+            }
+
+    def save(self):
+        with self.lock:
+            now = time.time()
+            entries = sorted(
+                (
+                    item
+                    for item in self.entries.items()
+                    if now - item[1]["used"] < TAG_CACHE_MAX_AGE
+                ),
+                key=lambda item: item[1]["used"],
+                reverse=True,
+            )
+            self.entries = dict(entries[:TAG_CACHE_MAX_ENTRIES])
+
+            with open(f"{self.path}.tmp", "w") as fp:
+                json.dump(self.entries, fp, indent=2, sort_keys=True)
+            os.replace(f"{self.path}.tmp", self.path)
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of a list of values.
+
+    Example: percentile([1, 2, 3, 4], 50) -> 2
+    """
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+class Timings:
+    """
+    Durations of the steps of the tag stage, per image.
+
+    The steps are inspect, probe, parse, label, rmi and tag. Images labelled
+    together with a single load of their configs get an equal share of the
+    duration of the load as label duration.
+    """
+
+    STEPS = ["inspect", "probe", "parse", "label", "rmi", "tag"]
+
+    def __init__(self):
+        self.images = {}
+        self.lock = threading.Lock()
+
+    def add(self, tag, step, seconds, **fields):
+        with self.lock:
+            record = self.images.setdefault(tag, {"tag": tag, "steps": {}})
+            record["steps"][step] = record["steps"].get(step, 0.0) + seconds
+            record.update(fields)
+
+    def note(self, tag, **fields):
+        with self.lock:
+            self.images.setdefault(tag, {"tag": tag, "steps": {}}).update(fields)
+
+    @contextmanager
+    def measure(self, tag, step, **fields):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(tag, step, time.monotonic() - start, **fields)
+
+    def write(self, path):
+        """
+        Write one JSON object per image with the durations of its steps.
+        """
+        with open(path, "w") as fp:
+            for record in self.images.values():
+                steps = {k: round(v, 4) for k, v in record["steps"].items()}
+                total = round(sum(record["steps"].values()), 4)
+                fp.write(json.dumps({**record, "steps": steps, "total": total}) + "\n")
+
+    def summary(self):
+        """
+        Returns:
+            Rows of step, number of images, sum, p50, p95 and max in seconds
+        """
+        rows = []
+        for step in self.STEPS + ["total"]:
+            if step == "total":
+                values = [sum(r["steps"].values()) for r in self.images.values()]
+            else:
+                values = [
+                    r["steps"][step] for r in self.images.values() if step in r["steps"]
+                ]
+            if not values:
+                continue
+
+            rows.append(
+                [
+                    step,
+                    len(values),
+                    round(sum(values), 2),
+                    round(percentile(values, 50), 2),
+                    round(percentile(values, 95), 2),
+                    round(max(values), 2),
+                ]
+            )
+
+        return rows
+
+
+def retag_repository(repository):
+    """
+    Name of the repository of a built image in the target namespace.
+
+    For releases, release/$OPENSTACK_VERSION is added to the namespace.
+    """
+    name = repository.split("/")[-1]
+    if KOLLA_TYPE and name.startswith(KOLLA_TYPE):
+        name = name[len(KOLLA_TYPE) :]  # noqa  E203 whitespace before ':'
+
+    if IS_RELEASE == "True":
+        repository = f"{DOCKER_NAMESPACE}/release/{OPENSTACK_VERSION}/{name}"
+    else:
+        repository = f"{DOCKER_NAMESPACE}/{name}"
+
+    if DOCKER_REGISTRY:
+        repository = f"{DOCKER_REGISTRY}/{repository}"
 
-client = DockerClient()
+    return repository
 
-list_of_images = []
 
-for image in client.images.list(filters=FILTERS):
+def retag_images(client, images):
+    """
+    Move the build tags of the built images to the tags of the OpenStack
+    version or the release.
+
+    The images are updated in place, analyse_image sees the new tags without
+    listing the images again.
+
+    Args:
+        client: Docker client
+        images: Images with the de.osism.release.openstack label
+
+    Returns:
+        New tags of the images
+    """
+    if OPENSTACK_VERSION == "latest":
+        tag = "latest"
+    elif os.environ.get("VERSION", "latest") == "latest":
+        tag = OPENSTACK_VERSION
+    else:
+        tag = os.environ.get("VERSION")
+
+    new_tags = []
+    for image in images:
+        for source in image.tags:
+            repository, _, source_tag = source.rpartition(":")
+            if source_tag != SOURCE_DOCKER_TAG:
+                continue
+
+            new_repository = retag_repository(repository)
+            new_tag = f"{new_repository}:{tag}"
+            logger.info(f"Tagging {source} as {new_tag}")
+
+            try:
+                client.api.tag(image.id, new_repository, tag)
+            except APIError as e:
+                logger.error(f"Failed to tag {source} as {new_tag}: {e}")
+                continue
+
+            new_tags.append(new_tag)
+            tags = [t for t in image.attrs.get("RepoTags") or [] if t != new_tag]
+            tags.append(new_tag)
+
+            # NOTE: The image keeps its new tag, only the build tag is removed.
+            try:
+                client.api.remove_image(source)
+                tags.remove(source)
+            except APIError as e:
+                logger.error(f"Failed to remove {source}: {e}")
+
+            image.attrs["RepoTags"] = tags
+
+    return new_tags
+
+
+def matches_filters(image, filters):
+    """
+    Check an image against label filters as accepted by client.images.list.
+    """
+    key, _, value = filters["label"].partition("=")
+    return image.labels.get(key) == value
+
+
+def analyse_image(registry, image):
+    """
+    Check the labels of an image and select the version extractor for it.
+
+    Args:
+        registry: Version extractors from etc/tag-images-with-the-version.yml
+        image: Docker image to analyse
+
+    Returns:
+        Dictionary describing the probe job, or None if the image is skipped
+    """
     build_date = None
     name = None
     version = None
 
     # skip images without a tag
     if not image.tags:
-        continue
+        return None
 
     tag = image.tags[0]
 
+    # NOTE: An image that was already relabelled in a previous run also carries
+    #       its version tag, the tag ending with the version is the one to use.
+    for candidate in image.tags:
+        if candidate.endswith(VERSION):
+            tag = candidate
+            break
+
     logger.info(f"Analysing {tag}")
 
     if "org.opencontainers.image.title" in image.labels:
         name = image.labels["org.opencontainers.image.title"]
     else:
         logger.info(f"Label org.opencontainers.image.title not found for {tag}")
-        continue
+        return None
 
     if IS_RELEASE == "True":
         if "de.osism.version" in image.labels:
             version = image.labels["de.osism.version"]
         else:
             logger.info(f"Label de.osism.version not found for {tag}")
-            continue
+            return None
     else:
         if "de.osism.release.openstack" in image.labels:
             version = image.labels["de.osism.release.openstack"]
         else:
             logger.info(f"Label de.osism.release.openstack not found for {tag}")
-            continue
+            return None
 
     if "build-date" in image.labels:
         # NOTE: maybe it is better to use org.opencontainers.image.created here
         build_date = image.labels["build-date"]
     else:
         logger.info(f"Label build-date not found for {tag}")
-        continue
+        return None
 
     # skip base images
     if name[-4:] == "base":
         logger.info(f"{tag} is a base image and not handled at the moment")
-        continue
+        return None
 
-    if tag[(-1 * len(version)) :] == VERSION:  # noqa  E203 whitespace before ':'
+    if tag[(-1 * len(version)) :] != VERSION:  # noqa  E203 whitespace before ':'
+        return None
 
-        best_key = None
-        if name in configuration:
-            best_key = name
+    best_key = None
+    if name in registry:
+        best_key = name
+    else:
+        # Try removing version suffixes like -v2, -v3 from the name
+        # e.g., prometheus-v2-server -> prometheus-server
+        name_without_version = sub(r"-v[0-9]+", "", name)
+        if name_without_version in registry:
+            best_key = name_without_version
         else:
-            # Try removing version suffixes like -v2, -v3 from the name
-            # e.g., prometheus-v2-server -> prometheus-server
-            name_without_version = sub(r"-v[0-9]+", "", name)
-            if name_without_version in configuration:
-                best_key = name_without_version
-            else:
-                best_key = name.split("-")[0]
+            best_key = name.split("-")[0]
 
-        if best_key not in configuration:
-            logger.error(f"Configuration for {name} ({best_key}) not found")
-            continue
+    if best_key not in registry:
+        logger.error(f"Configuration for {name} ({best_key}) not found")
+        return None
 
-        if best_key == "ovn" and OPENSTACK_VERSION in ["2024.1", "2024.2"]:
-            command = "ovn-controller --version"
-        else:
-            command = configuration[best_key]
+    extractor = registry[best_key]
+    logger.info(
+        f"Best match in configuration for {tag} is {best_key}, "
+        f"using {extractor.command or extractor.label}"
+    )
+
+    return {
+        "image": image,
+        "tag": tag,
+        "version": version,
+        "build_date": build_date,
+        "best_key": best_key,
+        "command": extractor.command,
+        "extractor": extractor,
+    }
+
+
+def parse_static_probe(command):
+    """
+    Check if a probe command only reads package metadata.
+
+    Args:
+        command: Probe command from the configuration
+
+    Returns:
+        Tuple of (kind, package) with kind "dpkg" or "python", None if the
+        command has to be run inside a container
+    """
+    if not command:
+        return None
+
+    parts = command.split()
+    if len(parts) != 3:
+        return None
+
+    if parts[:2] == ["pip3", "show"]:
+        return "python", normalise_distribution_name(parts[2])
+
+    if parts[:2] == ["dpkg", "-s"]:
+        return "dpkg", parts[2]
+
+    return None
+
+
+def run_static_probe(job, static_index):
+    """
+    Answer a probe command from the package metadata in the image layers.
+
+    Args:
+        job: Probe job as returned by analyse_image
+        static_index: Package metadata of the images, keyed by image ID
+
+    Returns:
+        Output in the format of pip3 show and dpkg -s, or None if the package
+        was not found in the layers
+    """
+    probe = parse_static_probe(job["command"])
+    if not probe or job["image"].id not in static_index:
+        return None
+
+    kind, package = probe
+    package_version = static_index[job["image"].id][kind].get(package)
+    if not package_version:
+        return None
+
+    logger.info(f"Found {package} in the layers of {job['tag']}")
+    return f"Name: {package}\nVersion: {package_version}\n"
+
+
+class ProbeGroups:
+    """
+    Share the output of container probes between images of a group.
+
+    Images with the same command whose layers start with the layers of the
+    same local *-base image and that add the same layers on top of it form a
+    group, e.g. images that only differ in their config. The command is run
+    in a container of the first image of the group only and its output is
+    reused for the others. If that run fails, the next image of the group
+    runs the command itself.
+
+    NOTE: The own layers of an image are part of the group, a service image
+          that installs or upgrades the probed package in its own layers
+          must not get the version of the *-base image.
+    """
+
+    def __init__(self, jobs, images, enabled=True):
+        self.keys = {}
+        self.locks = {}
+        self.outputs = {}
+
+        if not enabled:
+            return
+
+        bases = [
+            (image.attrs["RootFS"]["Layers"], image.id)
+            for image in images
+            if image.labels.get("org.opencontainers.image.title", "").endswith("base")
+        ]
+
+        for job in jobs:
+            if not job["command"]:
+                continue
+
+            layers = job["image"].attrs["RootFS"]["Layers"]
+            base_id = None
+            base_length = 0
+            for base_layers, image_id in bases:
+                if (
+                    base_length < len(base_layers) < len(layers)
+                    and layers[: len(base_layers)] == base_layers
+                ):
+                    base_id = image_id
+                    base_length = len(base_layers)
+
+            if base_id:
+                key = (job["command"], base_id, tuple(layers[base_length:]))
+                self.keys[job["image"].id] = key
+                self.locks.setdefault(key, threading.Lock())
 
         logger.info(
-            f"Best match in configuration for {tag} is {best_key}, using {command}"
+            f"Grouped {len(self.keys)} images into {len(self.locks)} probe groups"
         )
 
-        logger.info(f"Checking {tag}")
+    def run(self, client, job):
+        """
+        Run the probe command of a job, or reuse the output of its group.
+
+        Returns:
+            Decoded output of the probe command
+        """
+        key = self.keys.get(job["image"].id)
+        if key is None:
+            return client.containers.run(
+                job["image"], command=job["command"], remove=True, detach=False
+            ).decode("utf-8")
+
+        with self.locks[key]:
+            if key in self.outputs:
+                logger.info(f"Reusing the probe output of its group for {job['tag']}")
+                return self.outputs[key]
+
+            output = client.containers.run(
+                job["image"], command=job["command"], remove=True, detach=False
+            ).decode("utf-8")
+            self.outputs[key] = output
+            return output
 
+
+def label_image_with_build(client, tag, target_tag, target_version, timings):
+    """
+    Add the version label to an image with a FROM/LABEL build.
+
+    Args:
+        client: Docker client
+        tag: Current tag of the image, moved to the relabelled image
+        target_tag: Version tag of the relabelled image
+        target_version: Version of the service in the image
+        timings: Durations of the steps of the tag stage
+
+    Returns:
+        ID of the relabelled image
+    """
+    with timings.measure(tag, "label"):
+        with tempfile.NamedTemporaryFile() as fp:
+            fp.write(f"FROM {tag}\n".encode())
+            fp.write(
+                f"LABEL org.opencontainers.image.version='{target_version}'\n".encode()
+            )
+            fp.seek(0)
+
+            image, _ = client.images.build(fileobj=fp, tag=target_tag)
+
+    logger.info(f"Remove old image {tag}")
+    with timings.measure(tag, "rmi"):
+        try:
+            client.api.remove_image(tag, force=True)
+        except APIError as e:
+            logger.error(f"Failed to remove {tag}: {e}")
+
+    logger.info(f"Add new image {tag}")
+    with timings.measure(tag, "tag"):
+        repository, _, version_tag = tag.rpartition(":")
         try:
-            result = client.containers.run(
-                image, command=command, remove=True, detach=False
+            client.api.tag(target_tag, repository, version_tag)
+        except APIError as e:
+            logger.error(f"Failed to tag {target_tag} as {tag}: {e}")
+
+    return image.id
+
+
+def label_images_with_config(client, results, timings):
+    """
+    Add the version labels to images by rewriting their image configs.
+
+    All images are relabelled with a single call of the image import API. If
+    that fails, the images are relabelled one by one with a build.
+
+    Args:
+        client: Docker client
+        results: Results of process_image for the images to relabel
+        timings: Durations of the steps of the tag stage
+
+    Returns:
+        Results of the images that were relabelled successfully
+    """
+    relabels = [
+        {
+            "image": result["job"]["image"],
+            "labels": {"org.opencontainers.image.version": result["target_version"]},
+            "tags": [result["target_tag"], result["job"]["tag"]],
+        }
+        for result in results
+    ]
+
+    try:
+        start = time.monotonic()
+        new_ids = image_config.relabel_images(client, relabels)
+        share = (time.monotonic() - start) / len(results)
+        for result in results:
+            result["image_id"] = new_ids[result["job"]["image"].id]
+            timings.add(result["job"]["tag"], "label", share, batch=len(results))
+        return results
+    except Exception as e:
+        logger.warning(f"Rewriting the image configs failed, using builds: {e}")
+
+    labelled = []
+    for result in results:
+        try:
+            result["image_id"] = label_image_with_build(
+                client,
+                result["job"]["tag"],
+                result["target_tag"],
+                result["target_version"],
+                timings,
+            )
+            labelled.append(result)
+        except Exception as e:
+            logger.error(
+                f"Something went wrong while processing {result['job']['tag']}: {e}"
             )
-            result = result.decode("utf-8")
 
-            if best_key == "prometheus-libvirt-exporter":
-                # libvirt_exporter, version 2.2.0 (branch: , revision: unknown
-                r = findall(r"libvirt_exporter, version (.*) \(branch", result)
+    return labelled
 
-            elif best_key == "prometheus-openstack-exporter":
-                # 4827ad4a95c3af9f56c026e168168050429793c3406c0330b9f9c4049e8bca3f  /opt/openstack-exporter/openstack-exporter
-                checksum = findall(r"(\S+)\s*\/opt", result)
-                if (
-                    "4827ad4a95c3af9f56c026e168168050429793c3406c0330b9f9c4049e8bca3f"
-                    in checksum
-                ):
-                    r = ["1.7.0"]
-                else:
-                    r = [image.labels["de.osism.commit.kolla_version"]]
 
-            elif best_key == "prometheus-ovn-exporter":
-                # ovn-exporter 1.0.4
-                # ovn-exporter 1.0.7, commit: 79cb6010e656fd6b24c9ccba29bde4cddcf832c2
-                r = findall(r"ovn-exporter ([^,\n]+)", result)
+def process_image(client, job, static_index, label_mode, cache, groups, timings):
+    """
+    Probe the version of an image and retag it with that version.
 
-            elif best_key == "kolla-toolbox":
-                r = [image.labels["de.osism.commit.kolla_version"]]
+    Args:
+        client: Docker client
+        job: Probe job as returned by analyse_image
+        static_index: Package metadata of the images, keyed by image ID
+        label_mode: How the version label is added, in batch mode the image
+            is only probed and labelled later by label_images_with_config
+        cache: Probe results of previous runs
+        groups: Probe groups sharing the output of container probes
+        timings: Durations of the steps of the tag stage
 
-            elif best_key == "kafka":
-                # 2.0.1 (Commit:fa14705e51bd2ce5)
-                r = findall(r"(.*) \(Commit:", result)
+    Returns:
+        Dictionary with the job, the target version and the target tag of the
+        image, or None if no version was found
+    """
+    image = job["image"]
+    tag = job["tag"]
+    version = job["version"]
+    build_date = job["build_date"]
 
-            elif best_key == "letsencrypt-lego":
-                # lego version 4.20.4 linux/amd64
-                r = findall(r"lego version (.*) linux", result)
+    logger.info(f"Checking {tag}")
 
-            elif best_key == "ovn" and OPENSTACK_VERSION in ["2024.1", "2024.2"]:
-                # ovn-controller 22.03.0
-                r = findall(r"ovn-controller (.*)\n", result)
+    try:
+        target_version = cache.get(image.id, job["best_key"], build_date)
+        if target_version:
+            logger.info(f"Using cached version of {image.id} for {tag}")
+            timings.note(tag, source="cache")
+        else:
+            with timings.measure(tag, "probe"):
+                # NOTE: Extractors without a command only read image labels.
+                result = ""
+                source = "label"
+                if job["command"]:
+                    result = run_static_probe(job, static_index)
+                    source = "static"
+                if result is None:
+                    result = groups.run(client, job)
+                    source = "container"
+            timings.note(tag, source=source)
 
-            elif best_key.split("-")[0] == "prometheus":
-                # alertmanager, version 0.20.0 (branch: HEAD, revision: f74be0400a6243d10bb53812d6fa408ad71ff32d)
-                r = findall(r", version (.*) \(branch:", result)
+            with timings.measure(tag, "parse"):
+                raw_version = job["extractor"].extract(result, image.labels)
+                if raw_version:
+                    target_version = job["extractor"].normalise(raw_version)
 
-                if not r:
-                    # cAdvisor version v0.38.7 (57a2c804)
-                    r = findall(r"cAdvisor version v(.*) \(", result)
+            if not raw_version:
+                logger.warning(f"Version not found for {tag}")
+                return None
 
-                if not r:
-                    # mtail version v3.0.0-rc35 git revision a33283598c4b7a70fc2f113680318f29d5826cca go version go1.14 go arch amd64 go os linux
-                    r = findall(r"mtail version v?(.*) git revision", result)
+            cache.put(image.id, job["best_key"], build_date, target_version)
 
-                if not r:
-                    # v1.5.1 (msteams)
-                    r = findall(r"v(.*)", result)
+        logger.info(
+            f"Found version '{target_version}' with build date '{build_date}' for {tag}"
+        )
+        target_tag = f"{tag[:(-1 * len(version) - 1)]}:{target_version}.{build_date}"
 
-            elif best_key == "storm":
-                # Storm 1.2.2
-                r = findall(r"Storm (.*)", result)
+        if TAG_POSTFIX:
+            target_tag = f"{target_tag}.{TAG_POSTFIX}"
+            logger.info(
+                f"Tag postfix '{TAG_POSTFIX}. is defined, extended tag is {target_tag}."
+            )
 
-            elif best_key == "etcd":
-                # etcd Version: 3.2.26
-                r = findall(r"etcd Version: (.*)", result)
+        # Move release images to a release subproject with OpenStack version
+        if IS_RELEASE == "True":
+            release_namespace = f"/kolla/release/{OPENSTACK_VERSION}/"
+            if release_namespace not in target_tag:
+                target_tag = target_tag.replace("/kolla/", release_namespace)
 
-            elif best_key == "zookeeper":
-                # /opt/zookeeper/zookeeper-3.4.13.jar
-                r = findall(r"zookeeper-(.*)\.jar", result)
+        result = {
+            "job": job,
+            "target_version": target_version,
+            "target_tag": target_tag,
+        }
 
-            # everything else is a pip3 or dpkg version
-            else:
-                r = findall(r"Version: (.*)\n", result)
+        # NOTE: Images relabelled by a previous run keep their image ID, there
+        #       is nothing left to do for them.
+        if (
+            target_tag in image.tags
+            and image.labels.get("org.opencontainers.image.version") == target_version
+        ):
+            logger.info(f"{tag} is already labelled and tagged as {target_tag}")
+            result["image_id"] = image.id
+            return result
 
-            if r:
-                target_version = r[0].strip()
+        if label_mode == "batch":
+            return result
 
-                # remove X: prefix from ubuntu package versions
-                target_version = sub(r"[0-9]:", "", target_version)
+        logger.info(
+            f"Adding org.opencontainers.image.version='{target_version}' label to {tag}"
+        )
+        if label_mode == "config":
+            labelled = label_images_with_config(client, [result], timings)
+            return labelled[0] if labelled else None
 
-                # remove -X postfix
-                target_version = sub(r"-.*", "", target_version)
+        result["image_id"] = label_image_with_build(
+            client, tag, target_tag, target_version, timings
+        )
+        return result
+    except Exception as e:
+        logger.error(f"Something went wrong while processing {tag}: {e}")
+        return None
 
-                # remove +X postfix
-                target_version = sub(r"\+.*", "", target_version)
 
-                # remove pX postfix
-                target_version = sub(r"p.*", "", target_version)
+def write_sbom(flat_list_of_images):
+    """
+    Write images.yml with the list of images and the versions of the services.
 
-                # beautify version
-                parsed_version = packaging_version.parse(target_version)
+    Args:
+        flat_list_of_images: Target tags of all processed images
+    """
+    sbom = {
+        "openstack_version": OPENSTACK_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "images": [],
+        "versions": {},
+    }
 
-                # NOTE: We use only the first 3 places of the version. This prevents
-                #       versions like 15.0.0.0.
-                target_version = ".".join(
-                    [str(x) for x in list(parsed_version.release)[0:3]]
-                )
+    sbom_versions = {}
+    for image in flat_list_of_images:
+        sbom["images"].append({"image": image})
+        name, version = image.split("/")[-1].split(":")
+        sbom_versions[name] = version
 
-                logger.info(
-                    f"Found version '{target_version}' with build date '{build_date}' for {tag}"
-                )
-                target_tag = (
-                    f"{tag[:(-1 * len(version) - 1)]}:{target_version}.{build_date}"
+    for name in SBOM_IMAGE_TO_VERSION:
+        image_name = SBOM_IMAGE_TO_VERSION[name]
+        if image_name in sbom_versions:
+            sbom["versions"][name] = sbom_versions[image_name]
+        else:
+            # Try finding a version variant like prometheus-v2-server for prometheus-server
+            for sbom_name in sbom_versions:
+                if sub(r"-v[0-9]+", "", sbom_name) == image_name:
+                    sbom["versions"][name] = sbom_versions[sbom_name]
+                    break
+
+    with open("images.yml", "w+") as fp:
+        dump(sbom, fp, default_flow_style=False, explicit_start=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Tag the built images with the version of the contained service"
+    )
+    parser.add_argument(
+        "--parallel-jobs",
+        "-j",
+        type=int,
+        default=TAG_PARALLEL_JOBS,
+        help="Number of images probed in parallel (default: 8, env: TAG_PARALLEL_JOBS)",
+    )
+    parser.add_argument(
+        "--probe-mode",
+        choices=["container", "static"],
+        default=TAG_PROBE_MODE,
+        help="Run all probes in containers or read pip3 and dpkg versions from "
+        "the image layers (default: container, env: TAG_PROBE_MODE)",
+    )
+    parser.add_argument(
+        "--layer-cache",
+        type=str,
+        default=TAG_LAYER_CACHE,
+        help="Directory to keep the parsed layer metadata in between runs of the "
+        "static probe mode (default: in memory only, env: TAG_LAYER_CACHE)",
+    )
+    parser.add_argument(
+        "--label-mode",
+        choices=["build", "config", "batch"],
+        default=TAG_LABEL_MODE,
+        help="Add the version label with a FROM/LABEL build, by rewriting the "
+        "image config, or by rewriting the configs of all images in one pass "
+        "(default: build, env: TAG_LABEL_MODE)",
+    )
+    parser.add_argument(
+        "--cache-file",
+        type=str,
+        default=TAG_CACHE_FILE,
+        help="File with the probe results of previous runs, keyed by image ID "
+        "(default: .tag-images-cache.json, env: TAG_CACHE_FILE)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        default=False,
+        help="Probe all images, ignoring the results of previous runs",
+    )
+    parser.add_argument(
+        "--benchmark-extractors",
+        action="store_true",
+        default=False,
+        help="Run the version extractors over the recorded example outputs of the "
+        "configuration, print the time per extraction and exit",
+    )
+    parser.add_argument(
+        "--no-probe-groups",
+        action="store_true",
+        default=False,
+        help="Run the probe command in every image instead of once per group of "
+        "images with the same command, *-base image and own layers",
+    )
+    parser.add_argument(
+        "--retag",
+        action="store_true",
+        default=False,
+        help=f"Move the {SOURCE_DOCKER_TAG} tags of the built images to the tags of "
+        "the OpenStack version or the release first and write images.txt",
+    )
+    parser.add_argument(
+        "--timings-file",
+        type=str,
+        default=TAG_TIMINGS_FILE,
+        help="Write the durations of the steps of every image to this file as "
+        "JSON lines (env: TAG_TIMINGS_FILE)",
+    )
+    args = parser.parse_args()
+
+    if args.parallel_jobs < 1:
+        parser.error("--parallel-jobs must be at least 1")
+
+    registry = version_extractors.load_registry(
+        "etc/tag-images-with-the-version.yml", OPENSTACK_VERSION
+    )
+
+    if args.benchmark_extractors:
+        print(
+            tabulate(
+                version_extractors.benchmark(registry),
+                headers=["key", "example", "version", "usec"],
+                tablefmt="psql",
+            )
+        )
+        return
+
+    # NOTE: The connection pool of the client has to be at least as large as the
+    #       number of workers, otherwise the workers block each other on the socket.
+    client = DockerClient(max_pool_size=max(args.parallel_jobs, 10))
+
+    cache = ProbeCache(args.cache_file, enabled=not args.no_cache)
+
+    start = time.monotonic()
+    timings = Timings()
+    inspect_durations = {}
+
+    if args.retag:
+        # NOTE: The images are listed once for both stages, the images of a
+        #       release are selected from the built images by their label.
+        images = docker_stage.list_images(
+            client, RETAG_FILTERS, args.parallel_jobs, inspect_durations
+        )
+        retagged = retag_images(client, images)
+        images = [image for image in images if matches_filters(image, FILTERS)]
+    else:
+        images = docker_stage.list_images(
+            client, FILTERS, args.parallel_jobs, inspect_durations
+        )
+    jobs = [analyse_image(registry, image) for image in images]
+    jobs = [job for job in jobs if job]
+
+    for job in jobs:
+        timings.add(job["tag"], "inspect", inspect_durations.get(job["image"].id, 0.0))
+
+    try:
+        static_index = {}
+        if args.probe_mode == "static":
+            static_images = {
+                job["image"].id: job["image"].attrs["RootFS"]["Layers"]
+                for job in jobs
+                if parse_static_probe(job["command"])
+                and not cache.get(job["image"].id, job["best_key"], job["build_date"])
+            }
+            try:
+                layer_cache = image_metadata.LayerIndexCache(args.layer_cache)
+                static_index = image_metadata.index_images(static_images, layer_cache)
+            except Exception as e:
+                logger.warning(
+                    f"Reading the image layers failed, using containers: {e}"
                 )
 
-                if TAG_POSTFIX:
-                    target_tag = f"{target_tag}.{TAG_POSTFIX}"
-                    logger.info(
-                        f"Tag postfix '{TAG_POSTFIX}. is defined, extended tag is {target_tag}."
-                    )
+        groups = ProbeGroups(jobs, images, enabled=not args.no_probe_groups)
 
-                # Move release images to a release subproject with OpenStack version
-                if IS_RELEASE == "True":
-                    release_namespace = f"/kolla/release/{OPENSTACK_VERSION}/"
-                    if release_namespace not in target_tag:
-                        target_tag = target_tag.replace("/kolla/", release_namespace)
+        logger.info(
+            f"Probing {len(jobs)} images with {args.parallel_jobs} parallel jobs"
+        )
 
-                logger.info(
-                    f"Adding org.opencontainers.image.version='{target_version}' label to {tag}"
+        # NOTE: The results are returned in the order of the jobs, so images.lst
+        #       and images.yml are identical to those of a serial run.
+        results = docker_stage.gather(
+            [
+                partial(
+                    process_image,
+                    client,
+                    job,
+                    static_index,
+                    args.label_mode,
+                    cache,
+                    groups,
+                    timings,
                 )
-                with tempfile.NamedTemporaryFile() as fp:
-                    fp.write(f"FROM {tag}\n".encode())
-                    fp.write(
-                        f"LABEL org.opencontainers.image.version='{target_version}'\n".encode()
-                    )
-                    fp.seek(0)
+                for job in jobs
+            ],
+            args.parallel_jobs,
+        )
+        results = [result for result in results if result]
 
-                    client.images.build(fileobj=fp, tag=target_tag)
+        if args.label_mode == "batch":
+            unlabelled = [result for result in results if "image_id" not in result]
+            if unlabelled:
+                logger.info(
+                    "Adding org.opencontainers.image.version label to "
+                    f"{len(unlabelled)} images"
+                )
+                # NOTE: label_images_with_config sets the image_id of every
+                #       image it relabelled successfully.
+                label_images_with_config(client, unlabelled, timings)
+                results = [result for result in results if "image_id" in result]
 
-                logger.info(f"Remove old image {tag}")
-                subprocess.run(["docker", "rmi", "-f", tag])
+        # NOTE: The relabelled images are cached as well, a re-run skips them.
+        for result in results:
+            cache.put(
+                result["image_id"],
+                result["job"]["best_key"],
+                result["job"]["build_date"],
+                result["target_version"],
+            )
+    finally:
+        cache.save()
 
-                logger.info(f"Add new image {tag}")
-                subprocess.run(["docker", "tag", target_tag, tag])
+    list_of_images = [[result["target_tag"]] for result in results]
 
-                list_of_images.append([target_tag])
-            else:
-                logger.warning(f"Version not found for {tag}")
-        except Exception as e:
-            logger.error(f"Something went wrong while processing {tag}: {e}")
+    flat_list_of_images = [image[0] for image in list_of_images]
+    if args.retag:
+        with open("images.txt", "w+") as fp:
+            for image in retagged:
+                fp.write(f"{image}\n")
 
-flat_list_of_images = [image[0] for image in list_of_images]
-with open("images.lst", "w+") as fp:
-    for image in flat_list_of_images:
-        fp.write(f"{image}\n")
+    with open("images.lst", "w+") as fp:
+        for image in flat_list_of_images:
+            fp.write(f"{image}\n")
 
-sbom = {
-    "openstack_version": OPENSTACK_VERSION,
-    "created": datetime.now(timezone.utc).isoformat(),
-    "images": [],
-    "versions": {},
-}
+    write_sbom(flat_list_of_images)
 
-SBOM_IMAGE_TO_VERSION = {
-    "aodh": "aodh-api",
-    "barbican": "barbican-api",
-    "bifrost": "bifrost-deploy",
-    "blazar": "blazar-api",
-    "ceilometer": "ceilometer-central",
-    "cinder": "cinder-api",
-    "cloudkitty": "cloudkitty-api",
-    "collectd": "collectd",
-    "cron": "cron",
-    "designate": "designate-api",
-    "dnsmasq": "dnsmasq",
-    "elasticsearch": "elasticsearch",
-    "elasticsearch_curator": "elasticsearch-curator",
-    "etcd": "etcd",
-    "fluentd": "fluentd",
-    "glance": "glance-api",
-    "gnocchi": "gnocchi-api",
-    "heat": "heat-api",
-    "grafana": "grafana",
-    "haproxy": "haproxy",
-    "haproxy_ssh": "haproxy-ssh",
-    "horizon": "horizon",
-    "influxdb": "influxdb",
-    "ironic": "ironic-api",
-    "ironic_inspector": "ironic-inspector",
-    "iscsid": "iscsid",
-    "kafka": "kafka",
-    "keepalived": "keepalived",
-    "keystone": "keystone",
-    "kibana": "kibana",
-    "kolla_toolbox": "kolla-toolbox",
-    "kolla-toolbox": "kolla-toolbox",
-    "kuryr": "kuryr-libnetwork",
-    "letsencrypt_lego": "letsencrypt-lego",
-    "letsencrypt_webserver": "letsencrypt-webserver",
-    "logstash": "logstash",
-    "magnum": "magnum-api",
-    "manila": "manila-api",
-    "mariadb": "mariadb-server",
-    "masakari": "masakari-api",
-    "memcached": "memcached",
-    "mistral": "mistral-api",
-    "multipathd": "multipathd",
-    "neutron": "neutron-server",
-    "nova": "nova-api",
-    "nova_libvirt": "nova-libvirt",
-    "octavia": "octavia-api",
-    "opensearch": "opensearch",
-    "opensearch_dashboards": "opensearch-dashboards",
-    "openvswitch": "openvswitch-vswitchd",
-    "ovn": "ovn-controller",
-    "hacluster": "hacluster",
-    "hacluster_corosync": "hacluster-corosync",
-    "placement": "placement-api",
-    "prometheus": "prometheus-server",
-    "prometheus_alertmanager": "prometheus-alertmanager",
-    "prometheus_blackbox_exporter": "prometheus-blackbox-exporter",
-    "prometheus_cadvisor": "prometheus-cadvisor",
-    "prometheus_elasticsearch_exporter": "prometheus-elasticsearch-exporter",
-    "prometheus_haproxy_exporter": "prometheus-haproxy-exporter",
-    "prometheus_libvirt_exporter": "prometheus-libvirt-exporter",
-    "prometheus_memcached_exporter": "prometheus-memcached-exporter",
-    "prometheus_msteams": "prometheus-msteams",
-    "prometheus_mtail": "prometheus-mtail",
-    "prometheus_mysqld_exporter": "prometheus-mysqld-exporter",
-    "prometheus_node_exporter": "prometheus-node-exporter",
-    "prometheus_openstack_exporter": "prometheus-openstack-exporter",
-    "prometheus_ovn_exporter": "prometheus-ovn-exporter",
-    "proxysql": "proxysql",
-    "rabbitmq": "rabbitmq",
-    "redis": "redis",
-    "senlin": "senlin-api",
-    "skyline": "skyline-apiserver",
-    "skyline_console": "skyline-console",
-    "storm": "storm",
-    "swift": "swift-object",
-    "tgtd": "tgtd",
-    "trove": "trove-api",
-    "valkey": "valkey-server",
-    "watcher": "watcher-api",
-}
+    print()
+    print(tabulate(list_of_images, headers=["image"], tablefmt="psql"))
 
-sbom_versions = {}
-for image in flat_list_of_images:
-    sbom["images"].append({"image": image})
-    name, version = image.split("/")[-1].split(":")
-    sbom_versions[name] = version
+    duration = time.monotonic() - start
+    print()
+    print(
+        tabulate(
+            timings.summary(),
+            headers=["step", "images", "sum [s]", "p50 [s]", "p95 [s]", "max [s]"],
+            tablefmt="psql",
+        )
+    )
+    logger.info(
+        f"Processed {len(results)} images in {duration:.1f}s "
+        f"({len(results) / duration:.2f} images/s, {args.parallel_jobs} parallel jobs)"
+    )
 
-for name in SBOM_IMAGE_TO_VERSION:
-    image_name = SBOM_IMAGE_TO_VERSION[name]
-    if image_name in sbom_versions:
-        sbom["versions"][name] = sbom_versions[image_name]
-    else:
-        # Try finding a version variant like prometheus-v2-server for prometheus-server
-        for sbom_name in sbom_versions:
-            if sub(r"-v[0-9]+", "", sbom_name) == image_name:
-                sbom["versions"][name] = sbom_versions[sbom_name]
-                break
+    if args.timings_file:
+        timings.write(args.timings_file)
 
-with open("images.yml", "w+") as fp:
-    dump(sbom, fp, default_flow_style=False, explicit_start=True)
 
-print()
-print(tabulate(list_of_images, headers=["image"], tablefmt="psql"))
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Registry of version extractors for the tag stage.
+
+Every entry of etc/tag-images-with-the-version.yml describes how the version
+of the service in an image is found. An entry is either the probe command
+only, or a mapping with the keys
+
+    command    probe command run in the image (optional)
+    patterns   regular expressions tried in order, the first group of the first
+               match is the version (default: "Version: (.*)\\n", the format
+               of pip3 show and dpkg -s)
+    versions   maps matches to versions, e.g. checksums of binaries
+    label      image label used if no pattern matches
+    normalise  steps applied to the found version (default: NORMALISE)
+    examples   recorded outputs of the probe command, used by the benchmark
+    releases   overrides of the keys above for single OpenStack releases
+
+All patterns are compiled once when the registry is loaded, the extractor of
+an image is a single dictionary lookup.
+"""
+
+import re
+import timeit
+from typing import Dict, List, Optional
+
+from packaging import version as packaging_version
+from yaml import safe_load
+
+DEFAULT_PATTERNS = [r"Version: (.*)\n"]
+
+NORMALISE = [
+    "strip",
+    "strip-epoch",
+    "strip-revision",
+    "strip-build-metadata",
+    "strip-p-suffix",
+    "release",
+]
+
+EPOCH = re.compile(r"[0-9]:")
+REVISION = re.compile(r"-.*")
+BUILD_METADATA = re.compile(r"\+.*")
+P_SUFFIX = re.compile(r"p.*")
+
+
+def _release(target_version: str) -> str:
+    # NOTE: We use only the first 3 places of the version. This prevents
+    #       versions like 15.0.0.0.
+    parsed_version = packaging_version.parse(target_version)
+    return ".".join([str(x) for x in list(parsed_version.release)[0:3]])
+
+
+NORMALISE_STEPS = {
+    "strip": str.strip,
+    # remove X: prefix from ubuntu package versions
+    "strip-epoch": lambda x: EPOCH.sub("", x),
+    # remove -X postfix
+    "strip-revision": lambda x: REVISION.sub("", x),
+    # remove +X postfix
+    "strip-build-metadata": lambda x: BUILD_METADATA.sub("", x),
+    # remove pX postfix
+    "strip-p-suffix": lambda x: P_SUFFIX.sub("", x),
+    # beautify version
+    "release": _release,
+}
+
+
+class Extractor:
+    """
+    Precompiled version extractor of a single configuration entry.
+    """
+
+    def __init__(self, key: str, entry: Dict):
+        unknown = set(entry.get("normalise", [])) - set(NORMALISE_STEPS)
+        if unknown:
+            raise ValueError(f"Unknown normalise steps for {key}: {unknown}")
+
+        self.key = key
+        self.command = entry.get("command")
+        self.patterns = [
+            re.compile(pattern) for pattern in entry.get("patterns", DEFAULT_PATTERNS)
+        ]
+        self.versions = entry.get("versions")
+        self.label = entry.get("label")
+        self.normalise_steps = [
+            NORMALISE_STEPS[step] for step in entry.get("normalise", NORMALISE)
+        ]
+        self.examples = entry.get("examples", [])
+
+    def extract(self, output: str, labels: Dict[str, str]) -> Optional[str]:
+        """
+        Find the raw version in the output of the probe command.
+
+        Args:
+            output: Decoded output of the probe command
+            labels: Labels of the image
+
+        Returns:
+            Raw version string, or None if no version was found
+        """
+        for pattern in self.patterns:
+            if self.versions is None:
+                match = pattern.search(output)
+                if match:
+                    return match.group(1)
+                continue
+
+            for match in pattern.finditer(output):
+                if match.group(1) in self.versions:
+                    return str(self.versions[match.group(1)])
+
+        if self.label:
+            return labels.get(self.label)
+
+        return None
+
+    def normalise(self, raw_version: str) -> str:
+        """
+        Apply the normalisation pipeline to a raw version.
+
+        Example: "2:8.2.3-1ubuntu1" -> "8.2.3"
+        """
+        for step in self.normalise_steps:
+            raw_version = step(raw_version)
+        return raw_version
+
+
+def load_registry(path: str, openstack_version: str) -> Dict[str, Extractor]:
+    """
+    Load and compile the extractors of all configuration entries.
+
+    Args:
+        path: Path to etc/tag-images-with-the-version.yml
+        openstack_version: OpenStack release the overrides are taken for
+
+    Returns:
+        Mapping of configuration keys to extractors
+    """
+    with open(path, "r") as fp:
+        configuration = safe_load(fp)
+
+    registry = {}
+    for key, entry in configuration.items():
+        if not isinstance(entry, dict):
+            entry = {"command": entry}
+
+        releases = entry.get("releases", {})
+        entry = {k: v for k, v in entry.items() if k != "releases"}
+        entry.update(releases.get(openstack_version, {}))
+
+        registry[key] = Extractor(key, entry)
+
+    return registry
+
+
+def benchmark(registry: Dict[str, Extractor], number: int = 1000) -> List[List]:
+    """
+    Measure extraction and normalisation over the recorded probe outputs.
+
+    Args:
+        registry: Extractors as returned by load_registry
+        number: Number of repetitions per example
+
+    Returns:
+        Rows of key, example, extracted version and microseconds per call
+    """
+    rows = []
+    for key, extractor in sorted(registry.items()):
+        for example in extractor.examples:
+            raw_version = extractor.extract(example, {})
+            target_version = extractor.normalise(raw_version) if raw_version else None
+
+            def run():
+                raw_version = extractor.extract(example, {})
+                if raw_version:
+                    extractor.normalise(raw_version)
+
+            seconds = timeit.timeit(run, number=number)
+            rows.append(
+                [
+                    key,
+                    example.splitlines()[0][:60],
+                    target_version,
+                    round(seconds / number * 1e6, 2),
+                ]
+            )
+
+    return rows